@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand, CommandError
+from lib.LightBuildServer import LightBuildServer
+from lib.BuildScheduler import BuildScheduler
+from lib.WarmPool import WarmPool
+
+
+class Command(BaseCommand):
+    help = 'Run the scheduler as a service, and start the builds as soon as the queue or the machines change'
+
+    def handle(self, *args, **options):
+        LBS = LightBuildServer()
+        BuildScheduler(LBS, WarmPool(LBS)).run()
@@ -0,0 +1,34 @@
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from lib.LightBuildServer import LightBuildServer
+from lib.BuildScheduler import BuildScheduler
+from lib.BuildSupervisor import BuildSupervisor
+from lib.WarmPool import WarmPool
+
+
+class Command(BaseCommand):
+    help = 'Run the scheduler as a service, and run each build in its own worker process'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=settings.MAX_CONCURRENT_BUILDS,
+            help='the number of builds that run at the same time')
+
+    def handle(self, *args, **options):
+        supervisor = BuildSupervisor.setup(options['processes'], processes=True)
+        LBS = LightBuildServer()
+        scheduler = BuildScheduler(LBS, WarmPool(LBS))
+
+        def stop(signum, frame):
+            print("worker: stopping, waiting for the running builds to finish")
+            scheduler.stop()
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        # fails if there is another instance of this service, whose builds are not orphaned
+        scheduler.listen()
+        # an earlier instance of this service might have died during a build
+        LBS.ReconcileOrphanedBuilds()
+        scheduler.run()
+        supervisor.Shutdown()
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('builder', '0008_alter_log_options'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Worker',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=250, unique=True)),
+                ('host', models.CharField(max_length=250)),
+                ('pid', models.IntegerField()),
+                ('started', models.DateTimeField()),
+                ('heartbeat', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'lbs_worker',
+            },
+        ),
+        migrations.AddField(
+            model_name='build',
+            name='worker',
+            field=models.CharField(default=None, max_length=250, null=True),
+        ),
+    ]
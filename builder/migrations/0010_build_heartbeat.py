@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:13
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('builder', '0009_worker'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='build',
+            name='heartbeat',
+            field=models.DateTimeField(default=None, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='build',
+            index=models.Index(fields=['status', 'heartbeat'], name='lbs_build_status_heartbeat'),
+        ),
+    ]
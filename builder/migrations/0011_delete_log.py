@@ -0,0 +1,16 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:16
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('builder', '0010_build_heartbeat'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='Log',
+        ),
+    ]
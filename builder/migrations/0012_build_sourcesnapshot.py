@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('builder', '0011_delete_log'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='build',
+            name='sourcesnapshot',
+            field=models.CharField(default=None, max_length=40, null=True),
+        ),
+    ]
@@ -27,15 +27,26 @@ class Build(models.Model):
     finished = models.DateTimeField(default=None, null=True)
     hanging = models.BooleanField(default=False)
     buildsuccess = models.CharField(max_length=20,default=None, null=True)
+    # the name of the worker process that runs this build, see Worker
+    worker = models.CharField(max_length=250, default=None, null=True)
+    # updated regularly by the Logger while the build is writing output, see CheckForHangingBuild
+    heartbeat = models.DateTimeField(default=None, null=True)
+    # the sources of this build, see SourceSnapshots
+    sourcesnapshot = models.CharField(max_length=40, default=None, null=True)
 
     class Meta:
         db_table = "lbs_build"
+        indexes = [
+            models.Index(fields=["status", "heartbeat"], name="lbs_build_status_heartbeat"),
+        ]
 
-class Log(models.Model):
-    build = models.ForeignKey(Build, on_delete=models.CASCADE)
-    line = models.TextField()
-    created = models.DateTimeField()
+class Worker(models.Model):
+    # a process that runs builds, see BuildSupervisor
+    name = models.CharField(max_length=250, unique=True)
+    host = models.CharField(max_length=250)
+    pid = models.IntegerField()
+    started = models.DateTimeField()
+    heartbeat = models.DateTimeField()
 
     class Meta:
-        db_table = "lbs_log"
-        ordering = ("id",)
+        db_table = "lbs_worker"
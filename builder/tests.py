@@ -1,3 +1,54 @@
-from django.test import TestCase
+import subprocess
 
-# Create your tests here.
+from django.test import SimpleTestCase
+
+from lib.BuildHelper import BuildHelper
+
+
+class LocalContainer:
+    # runs the commands with the same quoting as RemoteContainer.executeInContainer, but on this machine
+    arch = "amd64"
+    release = "0"
+
+    def __init__(self):
+        self.logger = self
+        self.lines = []
+
+    def print(self, message):
+        pass
+
+    def executeInContainer(self, command):
+        result = subprocess.run("sh -c \"export LC_ALL=C; (" + command + ") 2>&1; echo \\$?\"",
+            shell=True, stdout=subprocess.PIPE)
+        self.lines = result.stdout.decode('utf-8').splitlines()
+        return result.returncode == 0 and self.lines[-1] == "0"
+
+
+class BatchTests(SimpleTestCase):
+
+    def runbatch(self, commands):
+        helper = BuildHelper(LocalContainer(), None)
+        helper.startbatch()
+        for (command, ignoreErrors) in commands:
+            helper.addtobatch(command, ignoreErrors)
+        return (helper.runbatch(), helper.container.lines)
+
+    def test_success(self):
+        (result, lines) = self.runbatch([("echo one", False), ("echo two", False)])
+        self.assertTrue(result)
+        self.assertEqual(lines, ["one", "two", "0"])
+
+    def test_failing_step_stops_the_batch(self):
+        (result, lines) = self.runbatch([("false", False), ("echo never", False)])
+        self.assertFalse(result)
+        self.assertNotIn("never", lines)
+        self.assertIn("batch step 1 failed with exit code 1", lines)
+
+    def test_ignored_failing_step(self):
+        (result, lines) = self.runbatch([("false", True), ("echo after", False)])
+        self.assertTrue(result)
+        self.assertIn("after", lines)
+
+    def test_ignored_failing_last_step(self):
+        (result, lines) = self.runbatch([("true", False), ("false", True)])
+        self.assertTrue(result)
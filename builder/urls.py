@@ -8,5 +8,9 @@ urlpatterns = [
     path('triggerbuild/<str:user>/<str:project>/<str:package>/<str:branchname>/<str:distro>/<str:release>/<str:arch>/<str:authuser>/<str:authpwd>', views.buildtarget, name='triggerbuildWithAuth'),
     path('cancelplannedbuild/<str:user>/<str:project>/<str:package>/<str:branchname>/<str:distro>/<str:release>/<str:arch>', views.cancelbuild, name='cancelplannedbuild'),
     path('logs/<str:user>/<str:project>/<str:package>/<str:branchname>/<str:distro>/<str:release>/<str:arch>/<str:buildnumber>', views.viewlog, name='viewlog'),
+    path('rawlog/<str:user>/<str:project>/<str:package>/<str:branchname>/<str:distro>/<str:release>/<str:arch>/<str:buildnumber>', views.rawlog, name='rawlog'),
     path('livelog/<str:user>/<str:project>/<str:package>/<str:branchname>/<str:distro>/<str:release>/<str:arch>/<str:buildid>', views.livelog, name='livelog'),
+    path('livelogupdates/<int:buildid>', views.livelogupdates, name='livelogupdates'),
+    path('livelogstream/<int:buildid>', views.livelogstream, name='livelogstream'),
+    path('rawlivelog/<int:buildid>', views.rawlivelog, name='rawlivelog'),
 ]
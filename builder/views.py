@@ -1,11 +1,20 @@
+import os
+import re
 import sys
+import json
+import asyncio
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect
 from django.contrib.auth import authenticate
+from django.utils.http import content_disposition_header
 
 from lib.Logger import Logger
 from lib.LightBuildServer import LightBuildServer
+from lib.LogSpool import LogSpool
 
 from django.contrib.auth.models import User
 from projects.models import Package, Project
@@ -55,6 +64,13 @@ def cancelbuild(request, user, project, package, branchname, distro, release, ar
         print(sys.exc_info())
         return machine_view.monitor(request, errormessage="Unexpected error")
 
+def getlineparameter(request):
+    # the line number in the query string, or None if there is none, or if it is not a number
+    try:
+        return max(0, int(request.GET.get('line')))
+    except (TypeError, ValueError):
+        return None
+
 def viewlog(request, user, project, package, branchname, distro, release, arch, buildnumber):
     build = Build.objects.filter(user__username=user).filter(project=project). \
         filter(package=package).filter(branchname=branchname). \
@@ -68,32 +84,214 @@ def viewlog(request, user, project, package, branchname, distro, release, arch,
         if request.user != project.user:
             raise Exception("you do not have permission for this project")
 
-    content = Logger().getLog(build)
+    # only read the requested page of the log
+    archive = Logger().getLogArchive(build)
+    count = archive.countlines()
+    errors = archive.geterrors()
+    pagesize = settings.LOG_PAGE_LINES
+    if request.GET.get('error') is not None and errors:
+        # the page with the first LBSERROR
+        line = errors[0] - errors[0] % pagesize
+    else:
+        line = getlineparameter(request) or 0
+    content = archive.read(line, line + pagesize)
+
+    if request.GET.get('format') == 'json':
+        return JsonResponse({'line': line, 'toline': min(count, line + pagesize), 'lines': count,
+            'errors': errors, 'output': content})
 
     return render(request, "builder/log.html",
         { 'buildresult': content,
          'timeoutInSeconds': -1,
          'package': package,
          'build': build,
+         'page': {
+            'line': line,
+            'toline': min(count, line + pagesize),
+            'lines': count,
+            'previous': max(0, line - pagesize) if line > 0 else None,
+            'next': line + pagesize if line + pagesize < count else None,
+            'last': max(0, count - 1) - max(0, count - 1) % pagesize,
+            'firsterror': errors[0] + 1 if errors else None,
+         },
         })
 
-def livelog(request, user, project, package, branchname, distro, release, arch, buildid):
+class RangeFile:
+    # only the requested part of a log file
+    def __init__(self, f, length):
+        self.f = f
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.f.close()
+
+def getrange(request, size):
+    # a single range is supported, eg. "bytes=-10000" for the end of the log.
+    # returns (start, end), or None for the whole file
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", request.headers.get('Range', '').strip())
+    if not match or not (match.group(1) or match.group(2)):
+        return None
+    if not match.group(1):
+        return (max(0, size - int(match.group(2))), size - 1)
+    start = int(match.group(1))
+    return (start, min(size - 1, int(match.group(2))) if match.group(2) else size - 1)
+
+def rangenotsatisfiable(size):
+    response = HttpResponse(status=416)
+    response['Content-Range'] = 'bytes */%d' % size
+    return response
+
+def sendlogfile(request, filename, encoding=None):
+    # the web server sends the file without Python reading it, eg. with sendfile in gunicorn.
+    f = open(filename, 'rb')
+    size = os.fstat(f.fileno()).st_size
+    # the client decompresses what it receives, so a range of the compressed file would be useless, see rawlog
+    byterange = None if encoding else getrange(request, size)
+    (start, end) = byterange or (None, None)
+    if byterange and (start >= size or start > end):
+        f.close()
+        return rangenotsatisfiable(size)
+    # the client stores the decompressed log, so it is not called .gz
+    name = os.path.basename(filename)
+    if encoding == 'gzip' and name.endswith('.gz'):
+        name = name[:-len('.gz')]
+    if start is None:
+        response = FileResponse(f, content_type="text/plain; charset=utf-8", filename=name)
+    else:
+        f.seek(start)
+        if end == size - 1:
+            # the rest of the file, this can still be sent by the web server
+            response = FileResponse(f, content_type="text/plain; charset=utf-8", status=206, filename=name)
+        else:
+            response = FileResponse(RangeFile(f, end - start + 1), content_type="text/plain; charset=utf-8", status=206, filename=name)
+        response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+        response['Content-Length'] = str(end - start + 1)
+    response['Accept-Ranges'] = 'bytes'
+    response['Vary'] = 'Accept-Encoding'
+    if encoding:
+        response['Content-Encoding'] = encoding
+    return response
+
+def sendlogarchive(request, archive):
+    # the decompressed log, for clients that do not accept gzip, and for range requests.
+    # the ranges refer to the decompressed log, so that a client can ask for the end of the log
+    byterange = None
+    if request.headers.get('Range'):
+        size = archive.getsize()
+        byterange = getrange(request, size)
+    if byterange is None:
+        response = StreamingHttpResponse(archive.readbytes(), content_type="text/plain; charset=utf-8")
+    else:
+        (start, end) = byterange
+        if start >= size or start > end:
+            return rangenotsatisfiable(size)
+        response = StreamingHttpResponse(archive.readbytes(start, end), content_type="text/plain; charset=utf-8", status=206)
+        response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+        response['Content-Length'] = str(end - start + 1)
+    response['Content-Disposition'] = content_disposition_header(False, os.path.basename(archive.plainfile))
+    response['Accept-Ranges'] = 'bytes'
+    response['Vary'] = 'Accept-Encoding'
+    return response
+
+def rawlog(request, user, project, package, branchname, distro, release, arch, buildnumber):
+    # the stored log as text, for scripts
+    build = Build.objects.filter(user__username=user).filter(project=project). \
+        filter(package=package).filter(branchname=branchname). \
+        filter(distro=distro).filter(release=release).filter(arch=arch).filter(number=buildnumber).first()
+
+    project = Project.objects.filter(user=build.user, name=build.project).first()
+
+    # is the correct user logged in? or the admin?
+    if not project.visible and not request.user.is_staff:
+        if request.user != project.user:
+            raise Exception("you do not have permission for this project")
+
+    archive = Logger().getLogArchive(build)
+    if os.path.isfile(archive.archivefile):
+        if 'gzip' in request.headers.get('Accept-Encoding', '') and not request.headers.get('Range'):
+            # the archive consists of gzip members, so the client can decompress it as it is
+            return sendlogfile(request, archive.archivefile, 'gzip')
+        return sendlogarchive(request, archive)
+    if os.path.isfile(archive.plainfile):
+        return sendlogfile(request, archive.plainfile)
+    raise Http404("there is no log for this build")
+
+def rawlivelog(request, buildid):
+    # the spool file of the running build, eg. for tailing with a range request
+    (build, project) = getbuildforlivelog(request, buildid)
+    spool = LogSpool(build.id)
+    if build.status != 'BUILDING' or not spool.exists():
+        raise Http404("the build is not running")
+    return sendlogfile(request, spool.logfile)
+
+def getbuildforlivelog(request, buildid):
     build = Build.objects.get(pk=buildid)
 
     project = Project.objects.get(user=build.user, name=build.project)
-    package = Package.objects.filter(project=project, name=package).first()
 
     # is the correct user logged in? or the admin?
     if not project.visible and not request.user.is_staff:
         if request.user != project.user:
             raise Exception("you do not have permission for this project")
 
+    return (build, project)
+
+def livelog(request, user, project, package, branchname, distro, release, arch, buildid):
+    (build, project) = getbuildforlivelog(request, buildid)
+    package = Package.objects.filter(project=project, name=package).first()
+
     lbs = LightBuildServer()
-    (content, timeout) = lbs.LiveLog(build)
+    line = 0
+    if build.status == 'BUILDING':
+        # the page only shows the last lines, the new lines are loaded by livelogupdates or livelogstream
+        update = lbs.LiveLogUpdate(build)
+        content = update['output']
+        line = update['line']
+        timeout = settings.LIVELOG_POLL_INTERVAL
+    else:
+        (content, timeout) = lbs.LiveLog(build)
 
     return render(request, "builder/log.html",
         { 'buildresult': content,
          'timeoutInSeconds': timeout,
          'package': package,
          'build': build,
+         'line': line,
+         'serverpush': settings.LIVELOG_SERVER_PUSH,
         })
+
+def livelogupdates(request, buildid):
+    # the new lines since the line that the client has already seen
+    (build, project) = getbuildforlivelog(request, buildid)
+    update = LightBuildServer().LiveLogUpdate(build, getlineparameter(request))
+    return JsonResponse(update)
+
+async def livelogstream(request, buildid):
+    # server-sent events with the new lines, as long as the build is running.
+    # the database and the spool file are accessed outside of the event loop
+    (build, project) = await sync_to_async(getbuildforlivelog)(request, buildid)
+    line = getlineparameter(request)
+    lbs = LightBuildServer()
+
+    async def events():
+        nonlocal build, line
+        while True:
+            update = await sync_to_async(lbs.LiveLogUpdate)(build, line)
+            if update['output'] or update['status'] != 'BUILDING':
+                yield "data: " + json.dumps(update) + "\n\n"
+            if update['status'] != 'BUILDING':
+                return
+            line = update['line']
+            await asyncio.sleep(1)
+            build = await Build.objects.aget(pk=build.pk)
+
+    response = StreamingHttpResponse(events(), content_type="text/event-stream")
+    response['Cache-Control'] = 'no-cache'
+    return response
@@ -130,4 +130,72 @@ STATIC_ROOT = os.path.join(BASE_DIR, "static")
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# LightBuildServer defaults, these can be overwritten in settings_local.py
+
+# the scheduler service is woken up through this socket when builds are added or machines are released
+SCHEDULER_SOCKET = "var/scheduler.sock"
+# in seconds. the scheduler checks the queue at least this often, even if nobody wakes it up
+SCHEDULER_POLL_INTERVAL = 30
+# number of containers per build target, that the scheduler keeps prepared on idle Incus machines
+# eg. {"fedora/42/amd64": 2, "debian/bookworm/amd64": 1}
+WARM_POOL = {}
+# keep a snapshot of the prepared container (Incus snapshot, or committed Docker image)
+PREPARED_SNAPSHOTS = True
+# in days. the snapshots are created again after this time, to get the latest updates
+SNAPSHOT_REFRESH_DAYS = 7
+# number of other build targets per Incus slot, whose container is kept with its snapshots
+INCUS_PARKED_TARGETS = 3
+# store a snapshot of the container after installing the build dependancies of a package.
+# the next build of the package skips the installation, if the build dependancies and the repositories did not change
+DEPENDANCY_SNAPSHOTS = True
+# number of snapshots with build dependancies that are kept per Incus slot, and Docker images per host
+DEPENDANCY_SNAPSHOTS_PER_SLOT = 10
+DEPENDANCY_SNAPSHOTS_PER_HOST = 50
+# in seconds. the ssh connections to the build machines stay open after the last command for this time
+SSH_CONTROL_PERSIST = 60
+# the number of builds that one scheduler process runs at the same time
+MAX_CONCURRENT_BUILDS = 20
+# in seconds. each process that runs builds reports regularly that it is still alive
+WORKER_HEARTBEAT_INTERVAL = 10
+# in seconds. the builds of a worker without heartbeat for this time are cancelled, and the machines are released
+WORKER_TIMEOUT = 60
+# in seconds. the output of the builds is appended to their spool files in batches, see lib/LogWriter.py and lib/LogSpool.py
+LOG_FLUSH_INTERVAL = 2
+# number of lines. write the batch earlier if there are that many lines waiting
+LOG_FLUSH_SIZE = 500
+# the live logs of the running builds. should be on the same file system as LOGS_PATH
+LOG_SPOOL_PATH = "var/spool"
+# number of lines. the live log sends at most that many new lines per update
+LIVELOG_MAX_LINES = 1000
+# the live log is pushed to the browser (server-sent events), instead of being polled every LIVELOG_POLL_INTERVAL seconds.
+# this needs an ASGI server, see lbs/asgi.py
+LIVELOG_SERVER_PUSH = False
+LIVELOG_POLL_INTERVAL = 2
+# the last lines of the running builds are kept in this cache, see CACHES. None to read the spool files.
+# the cache must be shared by all processes, eg. memcached, redis or the database cache. the local memory cache is not used
+LIVELOG_CACHE = None
+# number of lines per build in the cache
+LIVELOG_CACHE_LINES = 2000
+# in seconds. the lines of a build that does not write any output are dropped from the cache after that time
+LIVELOG_CACHE_TIMEOUT = 3600
+# number of lines. the logs of the finished builds are compressed in blocks of that many lines
+LOG_ARCHIVE_BLOCK_LINES = 1000
+# number of lines that are shown on one page of a log
+LOG_PAGE_LINES = 2000
+# the log of a build keeps the first and the last half of these limits, the lines in between are dropped. None for no limit
+LOG_MAX_LINES = 1000000
+LOG_MAX_BYTES = 200*1024*1024
+# keep the full output of a shortened log in build-NNNNNN.full.log.gz
+LOG_KEEP_FULL_OUTPUT = False
+# the source trees of the builds, one directory per version of a git repository
+SOURCE_SNAPSHOTS_PATH = "var/snapshots"
+# in bytes. the least recently used snapshots are deleted if the snapshots need more space
+SOURCE_SNAPSHOTS_DISK_BUDGET = 5*1024*1024*1024
+# in minutes. recently used snapshots are not deleted
+SOURCE_SNAPSHOTS_KEEP_MINUTES = 30
+# the local mirrors of the git repositories of the projects that have git_mirror enabled
+GIT_MIRRORS_PATH = "var/mirrors"
+# the threads for hashing the sources of the packages
+SOURCE_HASH_THREADS = 8
+
 from .settings_local import *
\ No newline at end of file
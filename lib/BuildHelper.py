@@ -20,17 +20,22 @@
 #
 import yaml
 import os.path
+import hashlib
+import inspect
 from collections import deque
 
 from django.conf import settings
+from django.db import transaction
 
-from projects.models import Project
+from projects.models import Project, Package, PackageDependancy, PackageDependancyClosure
+from lib.SourceSnapshots import SourceSnapshots
 
 class BuildHelper:
   'abstract base class for BuildHelper implementations for the various Linux Distributions'
 
   def __init__(self, container, build):
     self.container = container
+    self.batchcommands = []
     self.fedora = 0
     self.suse_version = 0
     self.rhel = 0
@@ -39,13 +44,25 @@ class BuildHelper:
       self.arch = container.arch
       self.release = container.release
       self.rhel = self.release
+    if build is None:
+      # only preparing the machine, see WarmPool
+      self.username = self.projectname = self.packagename = self.branchname = None
+      self.project = None
+      return
     self.username = build.user.username
     self.projectname = build.project
     self.packagename = build.package
     self.branchname = build.branchname
-    self.pathSrc = settings.GIT_SRC_PATH+"/"+self.username
     self.project = Project.objects.filter(user__username=self.username).filter(name=self.projectname).first()
     self.git_project_name = self.project.git_url.strip('/').split('/')[-1]
+    # see LightBuildServer.getPackagingInstructions
+    snapshotid = build.sourcesnapshot
+    if not snapshotid:
+      # eg. for the instructions on the package page, see LightBuildServer.GetAllInstructions
+      snapshotid = SourceSnapshots.GetLatest(self.project, self.branchname or self.project.git_branch)
+      if snapshotid is None:
+        raise Exception("there are no sources of the project " + self.projectname + ", they have not been fetched yet")
+    self.pathSrc = SourceSnapshots.GetPath(snapshotid)
 
   def log(self, message):
     if self.container is not None:
@@ -54,6 +71,31 @@ class BuildHelper:
   def run(self, command):
     return self.container.executeInContainer(command)
 
+  def startbatch(self):
+    # collect the following commands, and run them in one go, see runbatch
+    self.batchcommands = []
+
+  def addtobatch(self, command, ignoreErrors = False):
+    self.batchcommands.append((command, ignoreErrors))
+
+  def runbatch(self):
+    # run all collected commands as one script in the container, each command in its own subshell.
+    # the script stops at the first command that fails, unless the errors of that command are ignored.
+    # an ignored command must not decide the exit code of the script, even if it is the last one.
+    commands = self.batchcommands
+    self.batchcommands = []
+    if not commands:
+      return True
+    script = []
+    for step, (command, ignoreErrors) in enumerate(commands, start=1):
+      self.log("batch step " + str(step) + ": " + command)
+      if ignoreErrors:
+        script.append("(" + command + ") || true")
+      else:
+        script.append("(" + command + "); lbsrc=\\$?; if [ \\$lbsrc -ne 0 ]; then " +
+            "echo 'batch step " + str(step) + " failed with exit code' \\$lbsrc; exit \\$lbsrc; fi")
+    return self.run("; ".join(script))
+
   def PrepareMachineBeforeStart(self):
     print("not implemented")
     return True
@@ -66,6 +108,41 @@ class BuildHelper:
     print("not implemented")
     return True
 
+  def GetPrepareHash(self, distro, release, arch):
+    # the prepared container only depends on the build target, and on the commands for preparing the machine.
+    # these commands call other methods, so we use the source of the whole modules of the build helper
+    sha = hashlib.sha1((distro + "/" + release + "/" + arch).encode('utf-8'))
+    for module in (inspect.getmodule(BuildHelper), inspect.getmodule(type(self))):
+      sha.update(inspect.getsource(module).encode('utf-8'))
+    return sha.hexdigest()
+
+  def GetBuildDependanciesHash(self, distro, release, arch):
+    # the installed build dependancies depend on the prepared container, on the build requirements of the package,
+    # on the repositories that are configured for the project, and on the packages in the own repository of the project
+    self.release = release
+    self.arch = arch
+    sha = hashlib.sha1(self.GetPrepareHash(distro, release, arch).encode('utf-8'))
+    sha.update((self.username + "/" + self.projectname + "/" + self.packagename).encode('utf-8'))
+    # the setup.sh gets the branch, and can change what is installed
+    sha.update(str(self.branchname).encode('utf-8'))
+    (builddepends, deliverables) = self.GetDependanciesAndProvides()
+    sha.update("\n".join(sorted(builddepends)).encode('utf-8'))
+    configfile=self.pathSrc + "/" + self.git_project_name + "/config.yml"
+    if os.path.isfile(configfile):
+      with open(configfile, 'r') as stream:
+        prjconfig = yaml.load(stream, Loader=yaml.Loader)
+      if prjconfig and 'lbs' in prjconfig and distro in prjconfig['lbs'] and str(release) in prjconfig['lbs'][distro]:
+        sha.update(yaml.dump(prjconfig['lbs'][distro][str(release)]).encode('utf-8'))
+    myPath = self.username + "/" + self.projectname
+    if self.project.secret:
+      myPath = self.username + "/" + self.project.secret + "/" + self.projectname
+    repopath = settings.REPOS_PATH + "/" + myPath + "/" + distro + "/" + release
+    for indexfile in ("repodata/repomd.xml", "Packages.gz", "db/packages.db"):
+      if os.path.isfile(repopath + "/" + indexfile):
+        with open(repopath + "/" + indexfile, 'rb') as f:
+          sha.update(f.read())
+    return sha.hexdigest()
+
   def DownloadSources(self):
     # parse config.yml file and download the sources
     # unpacking and moving to the right place depends on the distro
@@ -128,129 +205,110 @@ class BuildHelper:
     return False
 
   def StorePackageDependancies(self, packages, builddepends):
-    con = Database(self.config)
     for package in packages:
-      # find the package id
-      cursor = con.execute("SELECT id FROM package WHERE username = ? AND projectname = ? AND packagename = ? AND branchname = ?", (self.username, self.projectname, package, self.branchname))
-      row = cursor.fetchone()
-      if row is None:
+      if not package in builddepends:
+        continue
+      # find the package
+      dependantpackage = Package.objects.filter(project=self.project).filter(name=package).first()
+      if dependantpackage is None:
         print("There is no package " + package)
         continue
-      packageid = row['id']
       # delete all dependancies
-      stmt = "DELETE FROM packagedependancy WHERE dependantpackage = ?"
-      cursor = con.execute(stmt, (packageid,))
-      con.commit()
-      for requiredpackage in builddepends[package]:
-        # find required package id
-        cursor = con.execute("SELECT id FROM package WHERE username = ? AND projectname = ? AND packagename = ? AND branchname = ?", (self.username, self.projectname, requiredpackage, self.branchname))
-        row = cursor.fetchone()
-        if row is not None:
-          requiredpackageid = row['id']
-          stmt = "INSERT INTO packagedependancy (dependantpackage, requiredpackage) VALUES (?, ?)"
-          cursor = con.execute(stmt, (packageid, requiredpackageid))
-          con.commit()
-    con.close()
+      PackageDependancy.objects.filter(dependantpackage=dependantpackage).delete()
+      for requiredpackagename in builddepends[package]:
+        # find required package
+        requiredpackage = Package.objects.filter(project=self.project).filter(name=requiredpackagename).first()
+        if requiredpackage is not None:
+          PackageDependancy(dependantpackage=dependantpackage, requiredpackage=requiredpackage).save()
+
+    self.StorePackageDependancyClosure()
     return
 
-  def CalculatePackageOrder(self, distro, release, arch):
-    result = deque()
+  def StorePackageDependancyClosure(self):
+    # calculate all direct and indirect dependancies of the packages of this project
+    requires = {}
+    for dependant, required in PackageDependancy.objects.filter(dependantpackage__project=self.project). \
+        values_list('dependantpackage_id', 'requiredpackage_id'):
+      requires.setdefault(dependant, set()).add(required)
+
+    closure = []
+    for dependant in requires:
+      visited = set()
+      todo = list(requires[dependant])
+      while todo:
+        required = todo.pop()
+        if required in visited or required == dependant:
+          continue
+        visited.add(required)
+        todo.extend(requires.get(required, ()))
+      for required in visited:
+        closure.append(PackageDependancyClosure(dependantpackage_id=dependant, requiredpackage_id=required))
+
+    with transaction.atomic():
+      PackageDependancyClosure.objects.filter(dependantpackage__project=self.project).delete()
+      PackageDependancyClosure.objects.bulk_create(closure)
+
+  def CalculatePackageGraph(self, distro, release, arch):
+    # returns the packages of the project in levels, and the packages that each package requires.
+    # the packages of one level only require packages of the previous levels,
+    # so all packages of one level can be built at the same time.
+    # returns (None, None) if there is a circular dependancy.
     self.release = release
     self.arch = arch
-    userconfig=self.config['lbs']['Users'][self.username]
-    projectconfig=userconfig['Projects'][self.projectname]
-    if 'Packages' in projectconfig:
-      packages = userconfig['Projects'][self.projectname]['Packages']
-    else:
-      packages = userconfig['Projects'][self.projectname]
-    unsorted={}
+    buildtarget = distro + "/" + release + "/" + arch
+    packages = []
+    for package in Package.objects.filter(project=self.project):
+      if buildtarget in package.get_buildtargets():
+        packages.append(package.name)
+
     builddepends={}
     depends={}
     providedby={}
     deliverables={}
     for package in packages:
-      excludeDistro=False
-      if packages[package] is not None and "ExcludeDistros" in packages[package]:
-        for exclude in packages[package]['ExcludeDistros']:
-          if (distro + "/" + release + "/" + arch).startswith(exclude):
-            excludeDistro = True
-      includeDistro=True
-      if packages[package] is not None and "Distros" in packages[package]:
-        includeDistro=False
-        for incl in packages[package]['Distros']:
-          if (distro + "/" + release + "/" + arch) == incl:
-            includeDistro=True
-      if includeDistro and not excludeDistro:
-        self.packagename=package
-        (builddepends[package],deliverables[package]) = self.GetDependanciesAndProvides()
-        for p in deliverables[package]:
-          unsorted[p] = 1
-          depends[p] = deliverables[package][p]['requires']
-          for pv in deliverables[package][p]['provides']:
-            providedby[pv] = package
-        if not package in unsorted:
-          unsorted[package] = 1
-        # useful for debugging:
-        if False:
-          print( package + " builddepends on: ")
-          for p in builddepends[package]:
-            print("   " + p)
-          print( package + " produces these packages: ")
-          for p1 in deliverables[package]:
-            for p in deliverables[package][p1]['provides']:
-              print("   " + p + " which requires during installation:")
-              for d in depends[p1]:
-                print("      " + d)
-
-    while len(unsorted) > 0:
-      nextPackage = None
-      for package in sorted(unsorted):
-        if package in packages and nextPackage is None:
-          missingRequirement=False
-          # check that this package does not require a package that is in unsorted
-          if package in depends:
-            for dep in depends[package]:
-              if dep in providedby:
-                pv = providedby[dep]
-                if pv != package and pv in unsorted and pv in packages:
-                  missingRequirement=True
-          if package in builddepends:
-            for dep in builddepends[package]:
-              if dep in providedby:
-                pv = providedby[dep]
-                if pv != package and pv in unsorted and pv in packages:
-                  missingRequirement=True
-          if not missingRequirement:
-            nextPackage=package
-      if nextPackage == None:
+      self.packagename=package
+      (builddepends[package],deliverables[package]) = self.GetDependanciesAndProvides()
+      providedby[package] = package
+      for p in deliverables[package]:
+        depends[p] = deliverables[package][p]['requires']
+        for pv in deliverables[package][p]['provides']:
+          providedby[pv] = package
+
+    # a package requires the packages that provide its build requirements,
+    # and the packages that are required for installing its deliverables
+    requires={}
+    for package in packages:
+      requires[package] = set()
+      requirements = list(builddepends[package])
+      for p in deliverables[package]:
+        requirements.extend(depends[p])
+      for dep in requirements:
+        if dep in providedby and providedby[dep] != package:
+          requires[package].add(providedby[dep])
+
+    levels=[]
+    done=set()
+    while len(done) < len(packages):
+      level = sorted([package for package in packages if not package in done and requires[package].issubset(done)])
+      if not level:
         # problem: circular dependancy
         print ("circular dependancy, remaining packages: ")
-        for package in unsorted:
-          if not package in packages:
-            continue
-          print(package)
-          print(" build requires: ")
-          if package in builddepends:
-            for dep in builddepends[package]:
-              if dep in providedby:
-                pv = providedby[dep]
-                if pv != package and pv in unsorted:
-                  print("   " + pv)
-          print(" install requires: ")
-          if package in depends:
-            for dep in depends[package]:
-              if dep in providedby:
-                pv = providedby[dep]
-                if pv != package and pv in unsorted:
-                  print("   " + pv)
-        return None
-      result.append(nextPackage)
-      for p in deliverables[nextPackage]:
-        if p in unsorted:
-          del unsorted[p]
-      if nextPackage in unsorted:
-        del unsorted[nextPackage]
-
-    self.StorePackageDependancies(packages, builddepends)
+        for package in sorted(packages):
+          if not package in done:
+            print(package + " requires: " + ", ".join(sorted(requires[package] - done)))
+        return (None, None)
+      levels.append(level)
+      done.update(level)
+
+    self.StorePackageDependancies(packages, requires)
+
+    return (levels, requires)
 
+  def CalculatePackageOrder(self, distro, release, arch):
+    (levels, requires) = self.CalculatePackageGraph(distro, release, arch)
+    if levels is None:
+      return None
+    result = deque()
+    for level in levels:
+      result.extend(level)
     return result
@@ -56,14 +56,14 @@ class BuildHelperCentos(BuildHelper):
         yumUtils="yum-utils yum-plugin-priorities"
     if self.yumOrDnf == "dnf":
       yumUtils="'dnf-command(config-manager)'"
-    if not self.run(self.yumOrDnf + " -y install tar createrepo gcc rpm-build rpm-sign gnupg make curl iptables rsync perl iproute " + yumUtils):
-      return False
+    self.startbatch()
+    self.addtobatch(self.yumOrDnf + " -y install tar createrepo gcc rpm-build rpm-sign gnupg make curl iptables rsync perl iproute " + yumUtils)
     # drop repositories that are installed by the docker image
     # they become activated by yum-builddep, and then the mirrors might not work
-    self.run("if [ -f /etc/yum.repos.d/CentOS-Sources.repo ]; then rm -Rf /etc/yum.repos.d/CentOS-Sources.repo; fi");
-    self.run("if [ -f /etc/yum.repos.d/CentOS-Vault.repo ]; then rm -Rf /etc/yum.repos.d/CentOS-Vault.repo; fi");
-    self.run("mkdir -p rpmbuild/{BUILD,RPMS,SOURCES,SPECS,SRPMS}")
-    return True
+    self.addtobatch("if [ -f /etc/yum.repos.d/CentOS-Sources.repo ]; then rm -Rf /etc/yum.repos.d/CentOS-Sources.repo; fi", True)
+    self.addtobatch("if [ -f /etc/yum.repos.d/CentOS-Vault.repo ]; then rm -Rf /etc/yum.repos.d/CentOS-Vault.repo; fi", True)
+    self.addtobatch("mkdir -p rpmbuild/{BUILD,RPMS,SOURCES,SPECS,SRPMS}", True)
+    return self.runbatch()
 
   def GetSpecFilename(self):
     if os.path.isdir(self.pathSrc + "/" + self.git_project_name + "/" + self.packagename):
@@ -148,16 +148,18 @@ class BuildHelperCentos(BuildHelper):
     specfile = self.pathSrc + "/" + self.git_project_name + "/" + self.packagename + "/" + self.GetSpecFilename()
     if os.path.isfile(specfile):
       remoteSpecName = self.git_project_name + "/" + self.packagename + "/" + self.packagename + ".spec"
-      self.run('sed -i "s/0%{?suse_version}/' + str(self.suse_version) + '/g" ' + remoteSpecName)
-      #self.run('sed -i "s/0%{?rhel}/' + str(self.rhel) + '/g" ' + remoteSpecName)
-      #self.run('sed -i "s/0%{?fedora}/' + str(self.fedora) + '/g" ' + remoteSpecName)
-      self.run("cp " + remoteSpecName + " rpmbuild/SPECS")
+      self.startbatch()
+      self.addtobatch('sed -i "s/0%{?suse_version}/' + str(self.suse_version) + '/g" ' + remoteSpecName, True)
+      #self.addtobatch('sed -i "s/0%{?rhel}/' + str(self.rhel) + '/g" ' + remoteSpecName, True)
+      #self.addtobatch('sed -i "s/0%{?fedora}/' + str(self.fedora) + '/g" ' + remoteSpecName, True)
+      self.addtobatch("cp " + remoteSpecName + " rpmbuild/SPECS", True)
 
       # copy patches, and other files (eg. env.sh for mono-opt)
-      self.run("cp " + self.git_project_name + "/" + self.packagename + "/* rpmbuild/SOURCES")
+      self.addtobatch("cp " + self.git_project_name + "/" + self.packagename + "/* rpmbuild/SOURCES", True)
 
       # move the sources that have been downloaded according to instructions in config.yml. see BuildHelper::DownloadSources
-      self.run("mv sources/* rpmbuild/SOURCES")
+      self.addtobatch("mv sources/* rpmbuild/SOURCES", True)
+      self.runbatch()
 
       arch=self.arch
       if arch == "amd64":
@@ -209,9 +211,10 @@ class BuildHelperCentos(BuildHelper):
           return False
 
       # add result to repo
-      self.run("mkdir -p ~/repo/src")
-      self.run("cp ~/rpmbuild/SRPMS/*.src.rpm ~/repo/src")
-      self.run("cp -R ~/rpmbuild/RPMS/* ~/repo")
+      self.startbatch()
+      self.addtobatch("mkdir -p ~/repo/src", True)
+      self.addtobatch("cp ~/rpmbuild/SRPMS/*.src.rpm ~/repo/src", True)
+      self.addtobatch("cp -R ~/rpmbuild/RPMS/* ~/repo", True)
 
       # clean up old packages
       MaximumAgeInSeconds=time.time() - (DeletePackagesAfterDays*24*60*60)
@@ -221,12 +224,13 @@ class BuildHelperCentos(BuildHelper):
           file=rpmfiles[i - 1][7:]
           # delete older rpm files, depending on DeletePackagesAfterDays
           if os.path.getmtime(repopath + "/" + arch + "/" + file) < MaximumAgeInSeconds:
-            self.run("rm -f " + "/root/repo/" + arch + "/" + file)
-            self.run("rm -f " + "/root/repo/" + arch + "/" + str.replace(file, self.packagename + "-", self.packagename + "-debuginfo-"))
+            self.addtobatch("rm -f " + "/root/repo/" + arch + "/" + file, True)
+            self.addtobatch("rm -f " + "/root/repo/" + arch + "/" + str.replace(file, self.packagename + "-", self.packagename + "-debuginfo-"), True)
             # TODO: what about other packages provided by that source package
-            self.run("rm -f " + "/root/repo/src/" + str.replace(file, arch+".rpm", "src.rpm"))
+            self.addtobatch("rm -f " + "/root/repo/src/" + str.replace(file, arch+".rpm", "src.rpm"), True)
 
-      if not self.run("cd repo && createrepo ."):
+      self.addtobatch("cd repo && createrepo .")
+      if not self.runbatch():
         return False
     return True
 
@@ -44,16 +44,14 @@ class BuildHelperDebian(BuildHelper):
     return True
 
   def PrepareForBuilding(self):
-    if not self.run("apt-get update"):
-      return False
-    if not self.run("DEBIAN_FRONTEND=noninteractive apt-get -y upgrade"):
-      return False
-    if not self.run("apt-get -y install build-essential ca-certificates iptables curl apt-transport-https reprepro wget rsync devscripts equivs iproute2 dirmngr"):
-      #apt-utils
-      return False
+    self.startbatch()
+    self.addtobatch("apt-get update")
+    self.addtobatch("DEBIAN_FRONTEND=noninteractive apt-get -y upgrade")
+    #apt-utils
+    self.addtobatch("apt-get -y install build-essential ca-certificates iptables curl apt-transport-https reprepro wget rsync devscripts equivs iproute2 dirmngr")
     # make sure we have a fully qualified hostname
-    self.run("echo '127.0.0.1     " + self.container.containername + "' > tmp; cat /etc/hosts >> tmp; mv tmp /etc/hosts")
-    return True
+    self.addtobatch("echo '127.0.0.1     " + self.container.containername + "' > tmp; cat /etc/hosts >> tmp; mv tmp /etc/hosts", True)
+    return self.runbatch()
 
   def GetDscFilename(self):
     filename = self.packagename + ".dsc"
@@ -145,30 +143,33 @@ class BuildHelperDebian(BuildHelper):
     if os.path.isfile(dscfile):
       pathPackageSrc="/root/" + self.git_project_name + "/" + self.packagename
 
+      self.startbatch()
+
       # if debian.tar.gz exists, assume the sources come from OBS
       if os.path.isfile(self.pathSrc + "/" + self.git_project_name + "/" + self.packagename + "/debian.tar.gz"):
-        self.run("cd " + pathPackageSrc + " && mkdir -p debian && tar xzf debian.tar.gz && rm debian.tar.gz");
-        self.run("cd " + pathPackageSrc + " && (for f in debian.*; do mv \$f debian/\${f:7}; done)")
+        self.addtobatch("cd " + pathPackageSrc + " && mkdir -p debian && tar xzf debian.tar.gz && rm debian.tar.gz", True)
+        self.addtobatch("cd " + pathPackageSrc + " && (for f in debian.*; do mv \$f debian/\${f:7}; done)", True)
         # make sure that we only have lowercase letters in the dsc filename
-        self.run("cd " + pathPackageSrc + " && (for f in *.dsc; do mv \$f \${f,,}; done)")
+        self.addtobatch("cd " + pathPackageSrc + " && (for f in *.dsc; do mv \$f \${f,,}; done)", True)
 
       # if *debian.tar.xz exists, the files might come from Debian Launchpad
       if len(glob.glob(self.pathSrc + "/" + self.git_project_name + "/" + self.packagename + "/*debian.tar.xz")) > 0:
-        self.run("cd " + pathPackageSrc + " && tar xf *debian.tar.xz && rm *debian.tar.xz");
+        self.addtobatch("cd " + pathPackageSrc + " && tar xf *debian.tar.xz && rm *debian.tar.xz", True)
 
       # unpack the sources
       # the sources have been downloaded according to instructions in config.yml. see BuildHelper::DownloadSources
-      self.run("cp /root/sources/* " + pathPackageSrc)
-      self.run("rm -Rf tmpSource && mkdir tmpSource")
-      self.run("for file in " + pathPackageSrc + "/*.tar.gz; do if [ -f \$file ]; then cd tmpSource && tar xzf \$file;rm " + pathPackageSrc + "/\`basename \$file\`; fi; done")
-      self.run("for file in " + pathPackageSrc + "/*.tar.xz; do if [ -f \$file ]; then cd tmpSource && tar xf \$file;rm " + pathPackageSrc + "/\`basename \$file\`; fi; done")
-      self.run("for file in " + pathPackageSrc + "/*.tgz; do if [ -f \$file ]; then cd tmpSource && tar xzf \$file;rm " + pathPackageSrc + "/\`basename \$file\`; fi; done")
-      self.run("for file in /root/sources/*.tar.xz; do if [ -f \$file ]; then cd tmpSource && tar xf \$file; rm " + pathPackageSrc + "/\`basename \$file\`; fi; done")
-      self.run("for file in /root/sources/*.tar.gz; do if [ -f \$file ]; then cd tmpSource && tar xzf \$file;rm " + pathPackageSrc + "/\`basename \$file\`; fi; done")
-      self.run("for file in /root/sources/*.tgz; do if [ -f \$file ]; then cd tmpSource && tar xzf \$file;rm " + pathPackageSrc + "/\`basename \$file\`; fi; done")
-      self.run("for file in /root/sources/*.tar.bz2; do if [ -f \$file ]; then cd tmpSource && tar xjf \$file; rm " + pathPackageSrc + "/\`basename \$file\`; fi; done")
-      self.run("for dir in tmpSource/*; do if [ -d \$dir ]; then mv \$dir/* " + self.git_project_name + "/" + self.packagename + "; mv \$dir/.* " + self.git_project_name + "/" + self.packagename + "; fi; done")
-      self.run("rm -Rf tmpSource")
+      self.addtobatch("cp /root/sources/* " + pathPackageSrc, True)
+      self.addtobatch("rm -Rf tmpSource && mkdir tmpSource", True)
+      self.addtobatch("for file in " + pathPackageSrc + "/*.tar.gz; do if [ -f \$file ]; then cd tmpSource && tar xzf \$file;rm " + pathPackageSrc + "/\`basename \$file\`; fi; done", True)
+      self.addtobatch("for file in " + pathPackageSrc + "/*.tar.xz; do if [ -f \$file ]; then cd tmpSource && tar xf \$file;rm " + pathPackageSrc + "/\`basename \$file\`; fi; done", True)
+      self.addtobatch("for file in " + pathPackageSrc + "/*.tgz; do if [ -f \$file ]; then cd tmpSource && tar xzf \$file;rm " + pathPackageSrc + "/\`basename \$file\`; fi; done", True)
+      self.addtobatch("for file in /root/sources/*.tar.xz; do if [ -f \$file ]; then cd tmpSource && tar xf \$file; rm " + pathPackageSrc + "/\`basename \$file\`; fi; done", True)
+      self.addtobatch("for file in /root/sources/*.tar.gz; do if [ -f \$file ]; then cd tmpSource && tar xzf \$file;rm " + pathPackageSrc + "/\`basename \$file\`; fi; done", True)
+      self.addtobatch("for file in /root/sources/*.tgz; do if [ -f \$file ]; then cd tmpSource && tar xzf \$file;rm " + pathPackageSrc + "/\`basename \$file\`; fi; done", True)
+      self.addtobatch("for file in /root/sources/*.tar.bz2; do if [ -f \$file ]; then cd tmpSource && tar xjf \$file; rm " + pathPackageSrc + "/\`basename \$file\`; fi; done", True)
+      self.addtobatch("for dir in tmpSource/*; do if [ -d \$dir ]; then mv \$dir/* " + self.git_project_name + "/" + self.packagename + "; mv \$dir/.* " + self.git_project_name + "/" + self.packagename + "; fi; done", True)
+      self.addtobatch("rm -Rf tmpSource", True)
+      self.runbatch()
 
       # read version from dsc file, that is on the build server
       # (setup.sh might overwrite the version number...)
@@ -222,15 +223,16 @@ class BuildHelperDebian(BuildHelper):
       if not self.run("cd " + self.git_project_name + "/" + self.packagename + " && dpkg-buildpackage -rfakeroot -b"):
         return False
 
+      self.startbatch()
       if os.path.isfile(privateLBSkey_filename):
-        if not self.run("cd repo; for f in ~/" + self.git_project_name + "/*.deb; do pkgname=\`basename \$f\`; pkgname=\`echo \$pkgname | awk -F '_' '{print \$1}'\`; reprepro --delete clearvanished; reprepro remove " + self.container.release + " \$pkgname; reprepro includedeb " + self.container.release + " ~/" + self.git_project_name + "/\`basename \$f\`; done"):
-          return False
-        self.run("rm -Rf repo/conf")
+        self.addtobatch("cd repo; for f in ~/" + self.git_project_name + "/*.deb; do pkgname=\`basename \$f\`; pkgname=\`echo \$pkgname | awk -F '_' '{print \$1}'\`; reprepro --delete clearvanished; reprepro remove " + self.container.release + " \$pkgname; reprepro includedeb " + self.container.release + " ~/" + self.git_project_name + "/\`basename \$f\`; done")
+        self.addtobatch("rm -Rf repo/conf", True)
       else:
         # add result to repo
-        self.run("mkdir -p ~/repo/" + self.container.arch + "/binary")
-        self.run("cp " + self.git_project_name + "/*.deb repo/" + self.container.arch + "/binary")
-      if not self.run("cd repo && dpkg-scanpackages -m . /dev/null | gzip -9c > Packages.gz"):
+        self.addtobatch("mkdir -p ~/repo/" + self.container.arch + "/binary", True)
+        self.addtobatch("cp " + self.git_project_name + "/*.deb repo/" + self.container.arch + "/binary", True)
+      self.addtobatch("cd repo && dpkg-scanpackages -m . /dev/null | gzip -9c > Packages.gz")
+      if not self.runbatch():
         return False
 
     return True
@@ -44,18 +44,20 @@ class BuildHelperFedora(BuildHelperCentos):
     return True
 
   def PrepareMachineAfterStart(self):
+    self.startbatch()
     if self.fedora == self.rawhide:
-      self.run("dnf install -y fedora-repos-rawhide dnf-plugins-core")
-      self.run("dnf config-manager --set-disabled fedora updates updates-testing")
-      self.run("dnf config-manager --set-enabled rawhide")
-      self.run("dnf clean -q dbcache metadata")
-      self.run("dnf  --releasever=rawhide --setopt=deltarpm=false distro-sync -y --nogpgcheck")
+      self.addtobatch("dnf install -y fedora-repos-rawhide dnf-plugins-core", True)
+      self.addtobatch("dnf config-manager --set-disabled fedora updates updates-testing", True)
+      self.addtobatch("dnf config-manager --set-enabled rawhide", True)
+      self.addtobatch("dnf clean -q dbcache metadata", True)
+      self.addtobatch("dnf  --releasever=rawhide --setopt=deltarpm=false distro-sync -y --nogpgcheck", True)
     elif self.fedora > self.latestrelease:
       # before the final release: make sure we receive the latest packages
-      self.run("dnf install -y dnf-plugins-core")
-      self.run("dnf config-manager --set-enabled updates-testing")
+      self.addtobatch("dnf install -y dnf-plugins-core", True)
+      self.addtobatch("dnf config-manager --set-enabled updates-testing", True)
     else:
       # disable updates-testing for the stable release
-      self.run("dnf install -y dnf-plugins-core")
-      self.run("dnf config-manager --set-disabled updates-testing")
+      self.addtobatch("dnf install -y dnf-plugins-core", True)
+      self.addtobatch("dnf config-manager --set-disabled updates-testing", True)
+    self.runbatch()
     return True
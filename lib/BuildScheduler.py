@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""BuildScheduler: long running service that dispatches the build queue"""
+
+# Copyright (c) 2014-2024 Timotheus Pokorra
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+# USA
+#
+
+import os
+import fcntl
+import socket
+import select
+import traceback
+from pathlib import Path
+
+from django.conf import settings
+
+class BuildScheduler:
+  'wait for changes of the build queue or the machines, and dispatch the waiting builds'
+
+  def __init__(self, LBS, warmpool = None):
+    self.LBS = LBS
+    self.warmpool = warmpool
+    self.socketpath = settings.SCHEDULER_SOCKET
+    self.sock = None
+    self.lock = None
+    self.stopping = False
+
+  def listen(self):
+    Path(os.path.dirname(os.path.abspath(self.socketpath))).mkdir(parents=True, exist_ok=True)
+    # only one scheduler per socket. the lock is held as long as the scheduler is running,
+    # so that a second scheduler or worker does not take over or remove the socket of the first one
+    self.lock = open(self.socketpath + ".lock", 'w')
+    try:
+      fcntl.flock(self.lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+      self.lock.close()
+      self.lock = None
+      raise Exception("there is already a scheduler listening on " + self.socketpath)
+    # the socket of a scheduler that has not been stopped properly
+    if os.path.exists(self.socketpath):
+      os.unlink(self.socketpath)
+    self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    self.sock.bind(self.socketpath)
+    self.sock.setblocking(False)
+
+  def close(self):
+    if self.sock is not None:
+      self.sock.close()
+      self.sock = None
+      if os.path.exists(self.socketpath):
+        os.unlink(self.socketpath)
+    if self.lock is not None:
+      self.lock.close()
+      self.lock = None
+
+  def wait(self, timeout):
+    # returns True if we have been woken up, False on timeout
+    readable, _, _ = select.select([self.sock], [], [], timeout)
+    if not readable:
+      return False
+    # several notifications might have arrived in the meantime, one pass handles all of them
+    while True:
+      try:
+        self.sock.recv(64)
+      except BlockingIOError:
+        break
+    return True
+
+  def run(self):
+    if self.sock is None:
+      self.listen()
+    print("BuildScheduler is listening on " + self.socketpath)
+    try:
+      while not self.stopping:
+        try:
+          self.LBS.ProcessBuildQueue()
+          if self.warmpool is not None:
+            self.warmpool.Refill()
+        except Exception as e:
+          print("BuildScheduler: problem processing the build queue: " + str(e))
+          traceback.print_exc()
+        # if nobody wakes us up, we still check regularly, eg. for hanging builds
+        self.wait(settings.SCHEDULER_POLL_INTERVAL)
+    finally:
+      self.close()
+
+  def stop(self):
+    # can be called from a signal handler. the current pass is finished first
+    self.stopping = True
+    BuildScheduler.notify()
+
+  @staticmethod
+  def notify():
+    # wake up the scheduler. it does not matter if there is no scheduler running,
+    # then the next cronjob or poll interval will pick up the change
+    try:
+      sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+      try:
+        sock.setblocking(False)
+        sock.sendto(b"1", settings.SCHEDULER_SOCKET)
+      finally:
+        sock.close()
+    except OSError:
+      pass
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""BuildSupervisor: run the builds of this process, supervised by one event loop"""
+
+# Copyright (c) 2014-2024 Timotheus Pokorra
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+# USA
+#
+
+import os
+import signal
+import socket
+import asyncio
+import traceback
+import multiprocessing
+from threading import Thread, Lock
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from builder.models import Build, Worker
+from lib.LogWriter import LogWriter
+
+def initworkerprocess():
+  # the worker process finishes its build, even if the service is being stopped, see BuildSupervisor.Shutdown
+  signal.signal(signal.SIGINT, signal.SIG_IGN)
+  signal.signal(signal.SIGTERM, signal.SIG_IGN)
+  import django
+  django.setup()
+
+def runbuildinprocess(buildid, buildmachine):
+  initworkerprocess()
+  from lib.LightBuildServer import LightBuildServer
+  from lib.Builder import Builder
+  from lib.Logger import Logger
+  build = Build.objects.get(pk=buildid)
+  build.buildmachine = buildmachine
+  try:
+    Builder(LightBuildServer(), Logger(build)).buildpackage(build)
+  finally:
+    # the process exits after the build, so we must not lose the last lines
+    LogWriter.get().Flush()
+
+class BuildSupervisor:
+  'keep track of the running builds, and run at most MAX_CONCURRENT_BUILDS builds at the same time'
+
+  instance = None
+  instanceLock = Lock()
+
+  @staticmethod
+  def get():
+    with BuildSupervisor.instanceLock:
+      if BuildSupervisor.instance is None:
+        BuildSupervisor.instance = BuildSupervisor(settings.MAX_CONCURRENT_BUILDS)
+      return BuildSupervisor.instance
+
+  @staticmethod
+  def setup(maxbuilds, processes):
+    # eg. for the worker service, see builder/management/commands/worker.py
+    with BuildSupervisor.instanceLock:
+      BuildSupervisor.instance = BuildSupervisor(maxbuilds, processes)
+      return BuildSupervisor.instance
+
+  def __init__(self, maxbuilds, processes = False):
+    self.maxbuilds = maxbuilds
+    self.processes = processes
+    self.running = set()
+    # the processes of the running builds, by build id
+    self.children = {}
+    self.lock = Lock()
+    self.stopped = False
+    self.name = socket.gethostname() + ":" + str(os.getpid())
+    # the steps of a build are still blocking calls, so they run in a bounded pool of threads.
+    # everything else, eg. waiting for the builds, happens on the event loop
+    self.executor = ThreadPoolExecutor(max_workers=self.maxbuilds, thread_name_prefix="lbs-build")
+    # we must be known as a living worker before we start the first build, see LightBuildServer.ReconcileOrphanedBuilds
+    self.ReportHeartbeat()
+    self.loop = asyncio.new_event_loop()
+    self.thread = Thread(target = self.runloop, daemon = True)
+    self.thread.start()
+    asyncio.run_coroutine_threadsafe(self.heartbeat(), self.loop)
+
+  def runloop(self):
+    asyncio.set_event_loop(self.loop)
+    self.loop.run_forever()
+
+  def HasCapacity(self):
+    with self.lock:
+      return len(self.running) < self.maxbuilds
+
+  def GetRunningBuilds(self):
+    with self.lock:
+      return sorted(self.running)
+
+  def Start(self, builder, build):
+    # can be called from any thread
+    with self.lock:
+      self.running.add(build.id)
+    return asyncio.run_coroutine_threadsafe(self.supervise(builder, build), self.loop)
+
+  def runbuild(self, builder, build):
+    # the threads of the pool are reused, so we must not keep a database connection that has timed out
+    close_old_connections()
+    try:
+      builder.buildpackage(build)
+    finally:
+      close_old_connections()
+
+  async def runbuildprocess(self, build):
+    # each build runs in a fresh process, which exits after the build.
+    # if the process dies, eg. killed by the OOM killer, only this build fails
+    process = multiprocessing.get_context("spawn").Process(target=runbuildinprocess,
+        args=(build.id, build.buildmachine), name="lbs-build-" + str(build.id))
+    await self.loop.run_in_executor(None, process.start)
+    with self.lock:
+      self.children[build.id] = process
+    try:
+      exited = self.loop.create_future()
+      self.loop.add_reader(process.sentinel, lambda: exited.done() or exited.set_result(True))
+      try:
+        await exited
+      finally:
+        self.loop.remove_reader(process.sentinel)
+      process.join()
+    finally:
+      with self.lock:
+        del self.children[build.id]
+    if process.exitcode != 0:
+      raise Exception("the build process has exited with code " + str(process.exitcode))
+
+  async def supervise(self, builder, build):
+    try:
+      if self.processes:
+        await self.runbuildprocess(build)
+      else:
+        await self.loop.run_in_executor(self.executor, self.runbuild, builder, build)
+    except Exception as e:
+      print("BuildSupervisor: problem with build " + str(build.id) + ": " + str(e))
+      traceback.print_exc()
+      # do not wait for CheckForHangingBuild
+      await self.loop.run_in_executor(None, builder.LBS.ReleaseOrphanedBuild, build.id)
+    finally:
+      with self.lock:
+        self.running.discard(build.id)
+
+  def ReportHeartbeat(self):
+    close_old_connections()
+    now = timezone.now()
+    Worker.objects.update_or_create(name=self.name,
+        defaults={'host': socket.gethostname(), 'pid': os.getpid(), 'heartbeat': now},
+        create_defaults={'host': socket.gethostname(), 'pid': os.getpid(), 'heartbeat': now, 'started': now})
+
+  async def heartbeat(self):
+    # the database must not be accessed from the event loop itself
+    while True:
+      await asyncio.sleep(settings.WORKER_HEARTBEAT_INTERVAL)
+      if self.stopped:
+        return
+      try:
+        await self.loop.run_in_executor(None, self.ReportHeartbeat)
+      except Exception as e:
+        print("BuildSupervisor: problem reporting the heartbeat: " + str(e))
+
+  def Shutdown(self):
+    # wait for the running builds, and then sign off
+    self.executor.shutdown(wait=True)
+    with self.lock:
+      children = list(self.children.values())
+    for process in children:
+      process.join()
+    self.stopped = True
+    close_old_connections()
+    LogWriter.get().Flush()
+    print("BuildSupervisor: log writer statistics: " + str(LogWriter.get().GetStats()))
+    Worker.objects.filter(name=self.name).delete()
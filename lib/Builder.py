@@ -20,6 +20,7 @@
 #
 
 from time import gmtime, strftime
+import time
 import datetime
 import os
 import traceback
@@ -38,6 +39,7 @@ from lib.BuildHelper import BuildHelper
 from lib.BuildHelperFactory import BuildHelperFactory
 from lib.Shell import Shell
 from lib.Logger import Logger
+from lib.BuildScheduler import BuildScheduler
 
 from machines.models import Machine
 from projects.models import Project, ProjectFile
@@ -52,7 +54,7 @@ class Builder:
     self.finished = False
     self.buildmachine = None
 
-  def createbuildmachine(self, distro, release, arch, buildmachine, packageSrcPath):
+  def createbuildmachine(self, distro, release, arch, buildmachine, packageSrcPath, build = None):
     self.buildmachine = buildmachine
     # create a container on a remote machine
     machine = Machine.objects.filter(host=buildmachine).first()
@@ -62,7 +64,63 @@ class Builder:
       self.container = DockerContainer(buildmachine, machine, self.logger, packageSrcPath)
     elif machine.type == 'copr':
       self.container = CoprContainer(buildmachine, machine, self.logger, packageSrcPath)
-    return self.container.createmachine(distro, release, arch, buildmachine)
+    if settings.PREPARED_SNAPSHOTS and not machine.static:
+      self.container.snapshotname = self.GetSnapshotName(distro, release, arch)
+      if settings.DEPENDANCY_SNAPSHOTS and build is not None:
+        self.container.depssnapshotname = self.GetDependanciesSnapshotName(build)
+    if machine.prepared_for == distro + "/" + release + "/" + arch:
+      if self.container.usepreparedmachine(distro, release, arch, buildmachine):
+        self.logger.print("using the container that has been prepared in advance")
+        return True
+    result = self.container.createmachine(distro, release, arch, buildmachine)
+    if result and self.container.restoredsnapshot:
+      if self.container.restoredsnapshot == self.container.depssnapshotname:
+        self.logger.print("using the snapshot " + self.container.restoredsnapshot + " with the installed build dependancies")
+      else:
+        self.logger.print("using the snapshot " + self.container.restoredsnapshot + " of the prepared container")
+    return result
+
+  def GetSnapshotName(self, distro, release, arch):
+    buildHelper = BuildHelperFactory.GetBuildHelper(distro, None, None)
+    preparehash = buildHelper.GetPrepareHash(distro, release, arch)
+    # the snapshot is refreshed regularly, to get the latest updates of the distribution
+    period = int(time.time() / (settings.SNAPSHOT_REFRESH_DAYS * 24 * 60 * 60))
+    return "lbs-" + preparehash[:12] + "-" + str(period)
+
+  def GetDependanciesSnapshotName(self, build):
+    buildHelper = BuildHelperFactory.GetBuildHelper(build.distro, None, build)
+    try:
+      depshash = buildHelper.GetBuildDependanciesHash(build.distro, build.release, build.arch)
+    except Exception as e:
+      # we just install the build dependancies again
+      self.logger.print("cannot calculate the build dependancies: " + str(e))
+      return None
+    period = int(time.time() / (settings.SNAPSHOT_REFRESH_DAYS * 24 * 60 * 60))
+    return "lbs-deps-" + depshash[:12] + "-" + str(period)
+
+  def preparebuildmachine(self):
+    # prepare container; this is specific to the distro
+    if self.container.prepared:
+      # see WarmPool
+      return
+    if self.container.restoredsnapshot:
+      if not self.container.startmachine():
+        raise Exception("Problem with startmachine")
+      self.logger.print("container has been started successfully")
+      return
+    if not self.buildHelper.PrepareMachineBeforeStart():
+      raise Exception("Problem with PrepareMachineBeforeStart")
+    if self.container.startmachine():
+      self.logger.print("container has been started successfully")
+    else:
+      raise Exception("Problem with startmachine")
+    if not self.buildHelper.PrepareMachineAfterStart():
+      raise Exception("Problem with PrepareMachineAfterStart")
+    if not self.buildHelper.PrepareForBuilding():
+      raise Exception("Problem with PrepareForBuilding")
+    if self.container.snapshotname is not None:
+      if not self.container.createsnapshot(self.container.snapshotname):
+        self.logger.print("could not create the snapshot " + self.container.snapshotname)
 
   def buildpackageOnCopr(self, build, packageSrcPath):
     project = Project.objects.filter(user = build.user, name=build.project).first()
@@ -124,10 +182,9 @@ class Builder:
     if not self.container.buildProject(settings.DOWNLOAD_URL + "/repos/" + myPath + "/" + build.distro + "/" + build.release + "/src/" + srcrpmfilename):
       raise Exception("problem building the package on copr")
 
-  def buildpackageOnContainer(self, build, pathSrc):
+  def installmounts(self, build, project):
         # install a mount for the project repo
         myPath = build.user.username + "/" + build.project
-        project = Project.objects.filter(user = build.user, name=build.project).first()
         if project.secret:
           myPath = build.user.username + "/" + project.secret + "/" + build.project
         mountPath=settings.REPOS_PATH + "/" + myPath + "/" + build.distro + "/" + build.release
@@ -136,22 +193,25 @@ class Builder:
         mountPath=settings.TARBALLS_PATH + "/" + myPath
         if not self.container.installmount(mountPath, "/mnt" + mountPath, "/root/tarball"):
           raise Exception("Problem with installmount")
- 
+
+  def buildpackageOnContainer(self, build, pathSrc):
+        project = Project.objects.filter(user = build.user, name=build.project).first()
+
         # prepare container, install packages that the build requires; this is specific to the distro
         self.buildHelper = BuildHelperFactory.GetBuildHelper(build.distro, self.container, build)
-        if not self.buildHelper.PrepareMachineBeforeStart():
-          raise Exception("Problem with PrepareMachineBeforeStart")
-        if self.container.startmachine():
-          self.logger.print("container has been started successfully")
+        if self.container.mountBeforeStart:
+          self.installmounts(build, project)
+          self.preparebuildmachine()
         else:
-          raise Exception("Problem with startmachine")
-        if not self.buildHelper.PrepareMachineAfterStart():
-          raise Exception("Problem with PrepareMachineAfterStart")
-        if not self.buildHelper.PrepareForBuilding():
-          raise Exception("Problem with PrepareForBuilding")
+          self.preparebuildmachine()
+          self.installmounts(build, project)
 
         # copy the repo to the container
         git_project_name = project.git_url.strip('/').split('/')[-1]
+        restoreddeps = self.container.restoredsnapshot is not None and self.container.restoredsnapshot == self.container.depssnapshotname
+        if restoreddeps:
+          # drop the files of the build that created the snapshot
+          self.container.executeInContainer("rm -Rf /root/" + git_project_name + " /root/sources")
         self.container.rsyncContainerPut(pathSrc+git_project_name, "/root/"+git_project_name)
 
         # copy the keys and other files to the container into the /root/.ssh directory
@@ -173,8 +233,14 @@ class Builder:
           raise Exception("Problem with InstallRepositories")
         if not self.buildHelper.SetupEnvironment(build.branchname):
           raise Exception("Setup script did not succeed")
-        if not self.buildHelper.InstallRequiredPackages():
-          raise Exception("Problem with InstallRequiredPackages")
+        if restoreddeps:
+          self.logger.print("the build dependancies have already been installed")
+        else:
+          if not self.buildHelper.InstallRequiredPackages():
+            raise Exception("Problem with InstallRequiredPackages")
+          if self.container.depssnapshotname is not None:
+            if not self.container.createsnapshot(self.container.depssnapshotname):
+              self.logger.print("could not create the snapshot " + self.container.depssnapshotname)
         # disable the network, so that only code from the tarball is being used
         if not self.buildHelper.DisableOutgoingNetwork():
           raise Exception("Problem with disabling the network")
@@ -217,7 +283,7 @@ class Builder:
     jobFailed = True
     if not gotPackagingInstructions:
       self.LBS.ReleaseMachine(build.buildmachine, jobFailed)
-    elif self.createbuildmachine(build.distro, build.release, build.arch, build.buildmachine, packageSrcPath):
+    elif self.createbuildmachine(build.distro, build.release, build.arch, build.buildmachine, packageSrcPath, build):
       try:
         if type(self.container) is CoprContainer:
           self.buildpackageOnCopr(build, packageSrcPath)
@@ -234,6 +300,8 @@ class Builder:
     else:
       self.logger.print("LBSERROR: There is a problem with creating the container!")
       self.LBS.ReleaseMachine(build.buildmachine, jobFailed)
+    if self.container is not None:
+      self.container.closeconnections()
     self.finished = True
     logpath=self.logger.getLogPath(build)
     build.number=self.logger.store(settings.DELETE_LOG_AFTER_DAYS, settings.KEEP_MINIMUM_LOGS, logpath)
@@ -255,6 +323,9 @@ class Builder:
     build.buildsuccess = Logger(build).getBuildResult()
     build.save()
 
+    # packages depending on this package can be built now
+    BuildScheduler.notify()
+
     self.logger.clean()
     return self.logger.get()
 
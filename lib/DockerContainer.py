@@ -23,6 +23,9 @@ import sys
 import os
 import time
 import socket
+import hashlib
+from django.conf import settings
+
 from lib.RemoteContainer import RemoteContainer
 from lib.Logger import Logger
 from lib.Shell import Shell
@@ -77,16 +80,49 @@ class DockerContainer(RemoteContainer):
       if self.release == 'jammy':
         self.release_for_docker = "22.04"
 
+    # the images depend on the Dockerfile of the package as well
+    self.snapshotname = self.getSnapshotNameForDockerfile(self.snapshotname)
+    self.depssnapshotname = self.getSnapshotNameForDockerfile(self.depssnapshotname)
+    for snapshotname in (self.depssnapshotname, self.snapshotname):
+      if snapshotname is not None and \
+         self.executeOnHost("docker image inspect " + self.getSnapshotImage(snapshotname) + " > /dev/null") == True:
+        self.restoredsnapshot = snapshotname
+        # tagging again sets the LastTagTime, for dropping the least recently used images, see createsnapshot
+        self.executeOnHost("docker tag " + self.getSnapshotImage(snapshotname) + " " + self.getSnapshotImage(snapshotname))
+        break
+
     return True
 
-  def startmachine(self):
-    Dockerfile="Dockerfiles/Dockerfile." + self.distro + self.release_for_docker
+  def getSnapshotNameForDockerfile(self, name):
+    DockerfileExt=self.getDockerfileExt()
+    if name is None or not os.path.exists(DockerfileExt):
+      return name
+    with open(DockerfileExt, 'rb') as f:
+      (key, period) = name.rsplit("-", 1)
+      return key + "-" + hashlib.sha1(f.read()).hexdigest()[:8] + "-" + period
+
+  def getDockerfileExt(self):
     DockerfileExt=self.packageSrcPath + "/Dockerfile." + self.distro + self.release_for_docker
     if not os.path.exists(DockerfileExt):
       DockerfileExt=self.packageSrcPath + "/Dockerfile." + self.distro
     if not os.path.exists(DockerfileExt):
       DockerfileExt=self.packageSrcPath + "/Dockerfile"
-    if os.path.exists(DockerfileExt):
+    return DockerfileExt
+
+  def getSnapshotImage(self, name):
+    return "lbs-snapshot:" + name
+
+  def startmachine(self):
+    # a connection to the container from before the restart would hang
+    self.closeconnection("container")
+    Dockerfile="Dockerfiles/Dockerfile." + self.distro + self.release_for_docker
+    DockerfileExt=self.getDockerfileExt()
+    if self.restoredsnapshot:
+      # start from the image that has been committed after preparing a container for the same build target
+      self.executeOnHost("mkdir -p /tmp/" + self.containername)
+      Dockerfile="/tmp/" + self.containername + "/Dockerfile.snapshot"
+      self.executeOnHost("echo 'FROM " + self.getSnapshotImage(self.restoredsnapshot) + "' > " + Dockerfile)
+    elif os.path.exists(DockerfileExt):
       self.executeOnHost("mkdir -p /tmp/" + self.containername)
       DockerfileOrig=Dockerfile
       Dockerfile="/tmp/" + self.containername + "/Dockerfile.new"
@@ -109,13 +145,26 @@ class DockerContainer(RemoteContainer):
     result = self.executeInContainer('echo "container is running"')
     return result
 
+  def createsnapshot(self, name):
+    image = self.getSnapshotImage(name)
+    if not self.executeOnHost("docker commit " + self.containername + " " + image):
+      return False
+    # drop the outdated images of the same build target
+    self.executeOnHost("docker images --format '{{.Repository}}:{{.Tag}}' lbs-snapshot | grep ':" + name[:name.rindex("-")] + "-' | grep -v -x '" + image + "' | xargs -r docker rmi")
+    if name.startswith("lbs-deps-"):
+      # only keep the most recently used images with build dependancies on this host
+      self.executeOnHost("for i in \\$(docker images --format '{{.Repository}}:{{.Tag}}' lbs-snapshot | grep ':lbs-deps-'); do " +
+          "echo \\$(docker image inspect -f '{{.Metadata.LastTagTime.Unix}}' \\$i) \\$i; done | " +
+          "sort -rn | tail -n +" + str(settings.DEPENDANCY_SNAPSHOTS_PER_HOST + 1) + " | cut -d' ' -f2 | xargs -r docker rmi")
+    return True
+
   def executeInContainer(self, command):
     """Execute a command in a container via SSH"""
     print (" * Executing '%s' in %s..." % (command,
                                              self.containername))
     # wait until ssh server is running
     for x in range(0, 24):
-      result = self.shell.executeshell('ssh -f -o "StrictHostKeyChecking no" -o Port=' + self.containerPort + ' -i ' + self.SSHContainerPath + "/container_rsa root@" + self.containerIP + " \"export LC_ALL=C; (" + command + ") 2>&1; echo \$?\"")
+      result = self.shell.executeshell(self.getExecuteInContainerCommand(command))
       if result:
         return self.logger.getLastLine() == "0"
       if x < 5:
@@ -129,14 +178,14 @@ class DockerContainer(RemoteContainer):
   def destroy(self):
     return self.executeOnHost("docker rm " + self.containername)
 
-  def stop(self):
+  def getStopCommand(self):
     #TODO docker stop does not work, not even for test job
-    #return self.executeOnHost("docker stop " + self.containername)
-    return self.executeOnHost("(systemctl restart docker || service docker restart) && sleep 10")
+    #return "docker stop " + self.containername
+    return "(systemctl restart docker || service docker restart) && sleep 10"
 
   def rsyncContainerPut(self, src, dest):
     dest = dest[:dest.rindex("/")]
-    result = self.shell.executeshell('rsync -avz -e "ssh -o \'StrictHostKeyChecking no\' -i ' + self.SSHContainerPath + "/container_rsa -p " + self.containerPort + '" ' + src + ' root@' + self.hostname + ':' + dest)
+    result = self.shell.executeshell('rsync -avz -e "ssh ' + self.getSSHOptions("container", self.containerPort) + '" ' + src + ' root@' + self.hostname + ':' + dest)
     return result
 
   def rsyncContainerGet(self, path, dest = None):
@@ -144,7 +193,7 @@ class DockerContainer(RemoteContainer):
       dest = path[:path.rindex("/")]
     if not os.path.isdir(dest):
       os.makedirs(dest)
-    result = self.shell.executeshell('rsync -avz -e "ssh -o \'StrictHostKeyChecking no\' -i ' + self.SSHContainerPath + "/container_rsa -p " + self.containerPort + '" root@' + self.hostname + ':' + path + ' ' + dest)
+    result = self.shell.executeshell('rsync -avz -e "ssh ' + self.getSSHOptions("container", self.containerPort) + '" root@' + self.hostname + ':' + path + ' ' + dest)
     return result
 
   def rsyncHostPut(self, src, dest = None):
@@ -152,7 +201,7 @@ class DockerContainer(RemoteContainer):
       dest = src
     dest = dest[:dest.rindex("/")]
     self.executeOnHost("mkdir -p `dirname " + dest + "`")
-    result = self.shell.executeshell('rsync -avz --delete -e "ssh -o \'StrictHostKeyChecking no\' -i ' + self.SSHContainerPath + "/container_rsa -p " + self.port + '" ' + src + ' root@' + self.hostname + ':' + dest)
+    result = self.shell.executeshell('rsync -avz --delete -e "ssh ' + self.getSSHOptions("host", self.port) + '" ' + src + ' root@' + self.hostname + ':' + dest)
     return result 
 
   def rsyncHostGet(self, path, dest = None):
@@ -160,7 +209,7 @@ class DockerContainer(RemoteContainer):
       dest = path[:path.rindex("/")]
     if not os.path.isdir(dest):
       os.makedirs(dest)
-    result = self.shell.executeshell('rsync -avz --delete -e "ssh -o \'StrictHostKeyChecking no\' -i ' + self.SSHContainerPath + "/container_rsa -p " + self.port + '" root@' + self.hostname + ':' + path + ' ' + dest)
+    result = self.shell.executeshell('rsync -avz --delete -e "ssh ' + self.getSSHOptions("host", self.port) + '" root@' + self.hostname + ':' + path + ' ' + dest)
     return result
 
   def installmount(self, srcpath, hostpath, containerpath):
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""GitMirror: a local bare mirror of a git repository, that is updated with incremental fetches"""
+
+# Copyright (c) 2014-2024 Timotheus Pokorra
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+# USA
+#
+
+import os
+import fcntl
+import base64
+import shutil
+import hashlib
+import tempfile
+import subprocess
+from pathlib import Path
+
+from django.conf import settings
+
+from lib.SourceFetcher import SourceFetcher
+
+class GitMirror:
+  '''GIT_MIRRORS_PATH/<sha1 of the url>.git is a bare mirror of the repository.
+  the first update clones the repository, later updates only fetch the new commits.
+  the tree of a commit is unpacked with git archive, see extract'''
+
+  def __init__(self, url, private_token = None):
+    self.url = url
+    self.private_token = private_token
+    self.path = settings.GIT_MIRRORS_PATH + "/" + hashlib.sha1(url.encode('utf-8')).hexdigest() + ".git"
+    # the commit that has been resolved, see resolve
+    self.commit = None
+
+  def git(self, args, cwd = None):
+    cmd = ['git']
+    if self.private_token and self.url.startswith("http"):
+      # works for Gitea and Gitlab. the token is not stored in the config of the mirror
+      auth = base64.b64encode(("oauth2:" + self.private_token).encode('utf-8')).decode('ascii')
+      cmd += ['-c', 'http.extraHeader=Authorization: Basic ' + auth]
+    env = dict(os.environ)
+    # fail instead of waiting for a password
+    env['GIT_TERMINAL_PROMPT'] = '0'
+    result = subprocess.run(cmd + args, cwd=cwd, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+      raise Exception("problem with the git mirror of " + self.url + ": " + result.stderr.decode('utf-8', errors='replace').strip())
+    return result.stdout.decode('utf-8', errors='replace').strip()
+
+  def update(self):
+    # only one process updates the mirror at a time
+    Path(settings.GIT_MIRRORS_PATH).mkdir(parents=True, exist_ok=True)
+    with open(self.path + ".lock", 'w') as lock:
+      fcntl.flock(lock, fcntl.LOCK_EX)
+      if os.path.isdir(self.path):
+        self.git(['fetch', '--prune', '--quiet', 'origin'], cwd=self.path)
+      else:
+        # clone into a temporary directory, so that there is no partial mirror after a failure
+        staging = tempfile.mkdtemp(dir=settings.GIT_MIRRORS_PATH, prefix="." + os.path.basename(self.path) + "-staging-")
+        try:
+          self.git(['clone', '--mirror', '--quiet', self.url, staging + "/mirror.git"])
+          os.rename(staging + "/mirror.git", self.path)
+        finally:
+          shutil.rmtree(staging, ignore_errors=True)
+
+  def resolve(self, branchname):
+    # returns the SHA of the commit of the branch, or of a tag or commit
+    try:
+      self.commit = self.git(['rev-parse', '--verify', '--quiet', branchname + '^{commit}'], cwd=self.path)
+    except Exception:
+      raise Exception("problem with the git mirror of " + self.url + ": cannot find the branch " + branchname)
+    return self.commit
+
+  def hasfile(self, filename):
+    # does the resolved commit contain the file
+    try:
+      self.git(['cat-file', '-e', self.commit + ':' + filename], cwd=self.path)
+    except Exception:
+      return False
+    return True
+
+  def extract(self, destination, name):
+    # unpack the tree of the resolved commit, without a working copy of the mirror
+    prefix = name + "/"
+    p = subprocess.Popen(['git', 'archive', '--format=tar', '--prefix=' + prefix, self.commit],
+        cwd=self.path, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+      SourceFetcher.extracttar(p.stdout, destination, name, self.url)
+    finally:
+      p.stdout.close()
+      if p.wait() != 0:
+        raise Exception("problem with the git mirror of " + self.url + ": git archive failed for " + self.commit)
@@ -23,6 +23,8 @@ import sys
 import os
 import time
 import socket
+from django.conf import settings
+
 from lib.RemoteContainer import RemoteContainer
 from lib.Logger import Logger
 from lib.Shell import Shell
@@ -33,6 +35,8 @@ class IncusContainer(RemoteContainer):
     self.SCRIPTS_PATH = "/usr/share/incus-scripts/"
 
     self.CONTAINER_PATH = "/var/lib/incus/containers/"
+    # the snapshot must not contain the mounts of another project, so we mount after preparing the container
+    self.mountBeforeStart = False
     if self.executeOnHost("cd " + self.CONTAINER_PATH + " || exit -1") == False:
       raise Exception("cannot find path for Incus containers")
 
@@ -46,14 +50,35 @@ class IncusContainer(RemoteContainer):
     self.arch = arch
     self.staticIP = staticIP
 
+    # the snapshots of a build target are kept in a container of the slot for this build target.
+    # while the slot is used for another build target, that container is parked under another name.
+    # we do not copy containers between slots, because the network configuration depends on the slot
+    target = None
+    if self.snapshotname is not None:
+      # lbs-<hash of the build target>, without the period, see Builder.GetSnapshotName
+      target = self.snapshotname[:self.snapshotname.rindex("-")]
+
     if not self.staticMachine:
       if self.executeOnHost("incus stop " + self.containername + " || echo 'container is not running'") == False:
         return False
       if self.executeOnHost(self.SCRIPTS_PATH + "listcontainers.sh | grep '" + self.containername + "' || exit -1") == True:
-        if self.executeOnHost("incus delete " + self.containername) == False:
+        self.restoresnapshot()
+        if not self.restoredsnapshot and not self.parkcontainer(target):
+          # this also deletes all snapshots of the container
+          if self.executeOnHost("incus delete " + self.containername) == False:
+            return False
+      if not self.restoredsnapshot and target is not None and \
+         self.executeOnHost("incus info " + self.getParkedName(target) + " > /dev/null || exit -1") == True:
+        # the container of this build target has been parked
+        if self.executeOnHost("incus move " + self.getParkedName(target) + " " + self.containername) == False:
           return False
+        self.restoresnapshot()
+        if not self.restoredsnapshot:
+          # the snapshots are too old
+          if self.executeOnHost("incus delete " + self.containername) == False:
+            return False
     result = False
-    if self.staticMachine:
+    if self.staticMachine or self.restoredsnapshot:
       result = True
     else:
       if distro == "centos":
@@ -66,6 +91,8 @@ class IncusContainer(RemoteContainer):
         result = self.executeOnHost(self.SCRIPTS_PATH + "initDebian.sh " + self.containername + " " + str(self.cid) + " " + release + " " + " 0")
       if distro == "ubuntu":
         result = self.executeOnHost(self.SCRIPTS_PATH + "initUbuntu.sh " + self.containername + " " + str(self.cid) + " " + release + " " + " 0")
+    if result == True and target is not None and not self.staticMachine and not self.restoredsnapshot:
+      result = self.executeOnHost("incus config set " + self.containername + " user.lbs-target " + target)
     if result == True:
       result = self.executeOnHost(self.SCRIPTS_PATH + "tunnelport.sh " + str(self.cid) + " 22")
     sshpath=self.CONTAINER_PATH + self.containername + "/rootfs/root/.ssh/"
@@ -75,7 +102,48 @@ class IncusContainer(RemoteContainer):
       result = self.executeOnHost("chmod 700 " + sshpath + " && chmod 600 " + sshpath + "authorized_keys")
     return result
 
+  def restoresnapshot(self):
+    # restore the container as it was after installing the build dependancies of the package,
+    # or as it was after preparing it for building
+    for snapshotname in (self.depssnapshotname, self.snapshotname):
+      if snapshotname is not None and \
+         self.executeOnHost("incus snapshot list " + self.containername + " --format csv --columns n | grep -x '" + snapshotname + "' || exit -1") == True and \
+         self.executeOnHost("incus snapshot restore " + self.containername + " " + snapshotname) == True:
+        self.restoredsnapshot = snapshotname
+        return
+
+  def getParkedName(self, target):
+    return self.containername + "-" + target
+
+  def parkcontainer(self, target):
+    # rename the stopped container, so that it keeps the snapshots of its own build target.
+    # returns False if the container should be deleted instead
+    if target is None or settings.INCUS_PARKED_TARGETS < 1:
+      return False
+    parked = self.containername + "-\\$t"
+    if self.executeOnHost("t=\\$(incus config get " + self.containername + " user.lbs-target) && " +
+        "[ x\\$t != x ] && [ x\\$t != x" + target + " ] && " +
+        "(incus delete " + parked + " > /dev/null 2>&1; incus move " + self.containername + " " + parked + ")") == False:
+      return False
+    # only keep the most recently used parked containers of this slot
+    self.executeOnHost("incus list --format csv --columns nl " + self.containername + "-lbs- | sort -t, -k2 -r | " +
+        "tail -n +" + str(settings.INCUS_PARKED_TARGETS + 1) + " | cut -d, -f1 | xargs -r -n1 incus delete")
+    return True
+
+  def usepreparedmachine(self, distro, release, arch, staticIP):
+    # the container has been created and prepared by the WarmPool, and should still be running
+    self.distro = distro
+    self.release = release
+    self.arch = arch
+    self.staticIP = staticIP
+    if self.executeOnHost("incus list --format csv --columns s " + self.containername + " | grep RUNNING || exit -1") == False:
+      return False
+    self.prepared = True
+    return True
+
   def startmachine(self):
+    # a connection to the container from before the restart would hang
+    self.closeconnection("container")
     if self.executeOnHost("incus start " + self.containername):
       # remove the ip address
       if self.containerPort == "22":
@@ -87,13 +155,25 @@ class IncusContainer(RemoteContainer):
       return result
     return False
 
+  def createsnapshot(self, name):
+    if not self.executeOnHost("incus snapshot create " + self.containername + " " + name):
+      return False
+    # drop the outdated snapshots of the same kind
+    self.executeOnHost("incus snapshot list " + self.containername + " --format csv --columns n | grep '^" + name[:name.rindex("-")] + "-' | " +
+        "grep -v -x '" + name + "' | xargs -r -n1 incus snapshot delete " + self.containername)
+    if name.startswith("lbs-deps-"):
+      # only keep the newest snapshots with build dependancies of this slot
+      self.executeOnHost("incus snapshot list " + self.containername + " --format csv --columns nT | grep '^lbs-deps-' | sort -t, -k2 -r | " +
+          "tail -n +" + str(settings.DEPENDANCY_SNAPSHOTS_PER_SLOT + 1) + " | cut -d, -f1 | xargs -r -n1 incus snapshot delete " + self.containername)
+    return True
+
   def executeInContainer(self, command):
     """Execute a command in a container via SSH"""
     print (" * Executing '%s' in %s..." % (command,
                                              self.containername))
     # wait until ssh server is running
     for x in range(0, 24):
-      result = self.shell.executeshell('ssh -f -o "StrictHostKeyChecking no" -o Port=' + self.containerPort + ' -i ' + self.SSHContainerPath + "/container_rsa root@" + self.containerIP + " \"export LC_ALL=C; (" + command + ") 2>&1; echo \$?\"")
+      result = self.shell.executeshell(self.getExecuteInContainerCommand(command))
       if result:
         return self.logger.getLastLine() == "0"
       if x < 5:
@@ -110,12 +190,12 @@ class IncusContainer(RemoteContainer):
   def destroy(self):
     return self.executeOnHost("incus delete " + self.containername + " && sleep 10")
 
-  def stop(self):
-    return self.executeOnHost("incus stop " + self.containername + " && sleep 10")
+  def getStopCommand(self):
+    return "incus stop " + self.containername + " && sleep 10"
 
   def rsyncContainerPut(self, src, dest):
     dest = dest[:dest.rindex("/")]
-    result = self.shell.executeshell('rsync -avz -e "ssh -o \'StrictHostKeyChecking no\' -i ' + self.SSHContainerPath + "/container_rsa -p " + self.containerPort + '" ' + src + ' root@' + self.containerIP + ':' + dest)
+    result = self.shell.executeshell('rsync -avz -e "ssh ' + self.getSSHOptions("container", self.containerPort) + '" ' + src + ' root@' + self.containerIP + ':' + dest)
     return result
 
   def rsyncContainerGet(self, path, dest = None):
@@ -123,14 +203,14 @@ class IncusContainer(RemoteContainer):
       dest = path[:path.rindex("/")]
     if not os.path.isdir(dest):
       os.makedirs(dest)
-    result = self.shell.executeshell('rsync -avz -e "ssh -i ' + self.SSHContainerPath + "/container_rsa -p " + self.port + '" root@' + self.hostname + ':' + self.CONTAINER_PATH + self.containername + '/rootfs' + path + ' ' + dest)
+    result = self.shell.executeshell('rsync -avz -e "ssh ' + self.getSSHOptions("host", self.port) + '" root@' + self.hostname + ':' + self.CONTAINER_PATH + self.containername + '/rootfs' + path + ' ' + dest)
     return result
 
   def rsyncHostPut(self, src, dest = None):
     if dest == None:
       dest = src
     dest = dest[:dest.rindex("/")]
-    result = self.shell.executeshell('rsync -avz --delete -e "ssh -i ' + self.SSHContainerPath + "/container_rsa -p " + self.port + '" ' + src + ' root@' + self.hostname + ':' + dest)
+    result = self.shell.executeshell('rsync -avz --delete -e "ssh ' + self.getSSHOptions("host", self.port) + '" ' + src + ' root@' + self.hostname + ':' + dest)
     return result 
 
   def rsyncHostGet(self, path, dest = None):
@@ -138,7 +218,7 @@ class IncusContainer(RemoteContainer):
       dest = path[:path.rindex("/")]
     if not os.path.isdir(dest):
       os.makedirs(dest)
-    result = self.shell.executeshell('rsync -avz --delete -e "ssh -i ' + self.SSHContainerPath + "/container_rsa -p " + self.port + '" root@' + self.hostname + ':' + path + ' ' + dest)
+    result = self.shell.executeshell('rsync -avz --delete -e "ssh ' + self.getSSHOptions("host", self.port) + '" root@' + self.hostname + ':' + path + ' ' + dest)
     return result
 
   def installmount(self, srcpath, hostpath, containerpath):
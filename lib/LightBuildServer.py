@@ -21,16 +21,18 @@
 
 from time import gmtime, strftime
 import os
+import socket
 import shutil
 import time
 import datetime
 import requests
+import urllib.parse
 import logging
 from threading import Thread, Lock
 from collections import deque
 
 from django.conf import settings
-from django.db.models import Q
+from django.db.models import Q, Case, When
 from django.utils import timezone
 
 from lib.RemoteContainer import RemoteContainer
@@ -40,12 +42,19 @@ from lib.CoprContainer import CoprContainer
 from lib.BuildHelper import BuildHelper
 from lib.BuildHelperFactory import BuildHelperFactory
 from lib.Logger import Logger
+from lib.LogSpool import LogSpool
+from lib.LiveLogCache import LiveLogCache
 from lib.Builder import Builder
-from lib.Shell import Shell
-
-from projects.models import Project, Package, PackageDependancy, PackageSrcHash, PackageBuildStatus
+from lib.BuildScheduler import BuildScheduler
+from lib.SourceFetcher import SourceFetcher
+from lib.SourceSnapshots import SourceSnapshots
+from lib.GitMirror import GitMirror
+from lib.SourceHasher import SourceHasher
+from lib.BuildSupervisor import BuildSupervisor
+
+from projects.models import Project, Package, PackageDependancy, PackageDependancyClosure, PackageSrcHash, PackageBuildStatus
 from machines.models import Machine
-from builder.models import Build, Log
+from builder.models import Build, Worker
 
 class LightBuildServer:
   'light build server based on lxc and git'
@@ -65,43 +74,91 @@ class LightBuildServer:
     else:
       m = m.filter(Q(host=build.designated_build_machine) | Q(Q(type='copr') & Q(host__startswith=build.designated_build_machine) & Q(static=True)))
 
-    machineToUse=None
-    machinePriorityToUse=101
-    for row in m:
-      if row.priority < machinePriorityToUse:
-        machinePriorityToUse = row.priority
-        machineToUse = row.host
-
-    if machineToUse is not None:
-      m = Machine.objects.filter(host=machineToUse).filter(status='AVAILABLE').first()
-      if m:
-        m.status = 'BUILDING'
-        m.build = build
-        m.save()
+    # prefer a machine with a container that has been prepared for this build target, see WarmPool.
+    # then the machine with the lowest priority value is preferred
+    buildtarget = build.distro + "/" + build.release + "/" + build.arch
+    m = m.filter(priority__lt=101).annotate(prepared=Case(
+        When(prepared_for=buildtarget, then=0),
+        When(prepared_for__isnull=True, then=1),
+        default=2)).order_by('prepared', 'priority', 'id')
+
+    # claim the machine with a conditional update, so that another scheduler cannot claim the same machine
+    for machineToUse in m.values_list('host', flat=True):
+      claimed = Machine.objects.filter(host=machineToUse).filter(status='AVAILABLE'). \
+          update(status='BUILDING', build=build)
+      if claimed == 1:
         print("GetAvailableBuildMachine found a free machine: " + machineToUse)
         return machineToUse
 
     print("GetAvailableBuildMachine cannot find a machine")
     return None
 
+  def GiveBackBuildMachine(self, buildmachine, build):
+    # the machine has been claimed, but the build was started by another scheduler in the meantime
+    Machine.objects.filter(host=buildmachine).filter(status='BUILDING').filter(build=build). \
+        update(status='AVAILABLE', build=None)
+
   def CheckForHangingBuild(self):
 
-      # check for hanging build (BuildingTimeout in config.yml)
+      # check for hanging builds (BUILDING_TIMEOUT in the settings):
+      # the build did not write any output, and therefore no heartbeat, for that time
+      stale = timezone.now()-datetime.timedelta(seconds=settings.BUILDING_TIMEOUT)
       builds = Build.objects.filter(status='BUILDING'). \
         filter(hanging=False). \
-        filter(Q(started__lt=timezone.now()-datetime.timedelta(seconds=settings.BUILDING_TIMEOUT))). \
-        order_by('id').reverse()
-      for row in builds:
-        log = Log.objects.filter(build=row).filter(Q(created__gt=datetime.datetime.now()-datetime.timedelta(seconds=settings.BUILDING_TIMEOUT)))
-        if not log.exists():
-          # mark the build as hanging, so that we don't try to release the machine several times
-          row.hanging = 1
-          row.save()
-          self.ReleaseMachine(row.buildmachine, True)
-          # when the build job realizes that the buildmachine is gone:
-          #   the log will be written, email sent, and logs cleared
-          #   the build will be marked as failed as well
-          return
+        filter(Q(heartbeat__lt=stale) | Q(heartbeat__isnull=True, started__lt=stale))
+      hanging = list(builds.values_list('id', flat=True))
+      if not hanging:
+        return
+      # mark the builds as hanging, so that we don't try to release the machines several times
+      Build.objects.filter(pk__in=hanging).filter(hanging=False).update(hanging=True)
+      for machine in Machine.objects.filter(build__in=hanging):
+        self.ReleaseMachine(machine.host, True)
+        # when the build job realizes that the buildmachine is gone:
+        #   the log will be written, email sent, and logs cleared
+        #   the build will be marked as failed as well
+
+  def ReleaseOrphanedBuild(self, buildid):
+      # the worker of this build has stopped without finishing the build
+      build = Build.objects.filter(pk=buildid).filter(status='BUILDING').first()
+      if build is None:
+        return
+      print("ReleaseOrphanedBuild %d of worker %s" % (build.id, build.worker))
+      Build.objects.filter(pk=build.pk).filter(status='BUILDING'). \
+          update(status='CANCELLED', hanging=True, finished=timezone.now())
+      machine = Machine.objects.filter(build=build).first()
+      if machine is not None:
+        self.ReleaseMachine(machine.host, True)
+
+  def ReconcileOrphanedBuilds(self):
+      # release the builds and machines of workers that are gone, without waiting for BUILDING_TIMEOUT
+      myhost = socket.gethostname()
+      stale = timezone.now() - datetime.timedelta(seconds=settings.WORKER_TIMEOUT)
+      workers = {}
+      for worker in Worker.objects.all():
+        alive = worker.heartbeat >= stale
+        if alive and worker.host == myhost:
+          # on this host, we can see immediately whether the process is still running
+          try:
+            os.kill(worker.pid, 0)
+          except ProcessLookupError:
+            alive = False
+          except PermissionError:
+            pass
+        workers[worker.name] = alive
+      for build in Build.objects.filter(status='BUILDING').filter(worker__isnull=False):
+        if not workers.get(build.worker, False):
+          self.ReleaseOrphanedBuild(build.id)
+      # the containers that a worker that is gone has been preparing for the WarmPool
+      for machine in Machine.objects.filter(status='PREPARING'):
+        if not workers.get(machine.worker, False):
+          if Machine.objects.filter(pk=machine.pk).filter(status='PREPARING').filter(worker=machine.worker). \
+              update(status='STOPPING') == 1:
+            print("ReconcileOrphanedBuilds: releasing %s, which was prepared by %s" % (machine.host, machine.worker))
+            self.ReleaseMachine(machine.host, False)
+      # forget the workers that are gone
+      for name, alive in workers.items():
+        if not alive:
+          Worker.objects.filter(name=name).filter(heartbeat__lt=stale).delete()
 
   def CancelPlannedBuild(self, project, packagename, branchname, distro, release, arch):
       build = Build.objects.filter(status='WAITING'). \
@@ -128,13 +185,13 @@ class LightBuildServer:
     print("ReleaseMachine %s" % (buildmachine))
     machine = Machine.objects.filter(host=buildmachine).first()
 
-    # only release the machine when it is building
-    if machine.status == 'BUILDING' or machine.status == 'STOPPING':
-      if jobFailed:
+    # only release the machine when it is building, or preparing a container for the WarmPool
+    if machine.status in ('BUILDING', 'STOPPING', 'PREPARING'):
+      if jobFailed and machine.build:
         self.CancelWaitingJobsInQueue(machine.build)
 
+      Machine.objects.filter(pk=machine.pk).update(status='STOPPING', prepared_for=None, worker=None)
       machine.status = 'STOPPING'
-      machine.save()
 
       if machine.type == 'incus':
         IncusContainer(buildmachine, machine, Logger(), '').stop()
@@ -143,30 +200,37 @@ class LightBuildServer:
       elif machine.type == 'copr':
         CoprContainer(buildmachine, machine, Logger(), '').stop()
 
+      Machine.objects.filter(pk=machine.pk).filter(status='STOPPING').update(status='AVAILABLE')
       machine.status = 'AVAILABLE'
-      machine.save()
 
       if machine.build and machine.build.status == 'BUILDING':
         machine.build.status = 'CANCELLED'
         machine.build.save()
 
+      # the machine is free now, the next build can start
+      BuildScheduler.notify()
+
   def CanFindDependanciesBuilding(self, build):
-    machines = Machine.objects.filter(status='BUILDING'). \
-        filter(build__user__username=build.user.username). \
-        filter(build__project=build.project). \
-        filter(build__branchname=build.branchname). \
-        filter(build__distro=build.distro). \
-        filter(build__release=build.release). \
-        filter(build__arch=build.arch)
-    for row in machines:
-      # there is a machine building a package on the same queue (same user, project, branch, distro, release, arch)
-      # does this package actually depend on that other package?
-      dependantpackage = self.GetPackage(build.user.username, build.project, build.package, build.branchname)
-      requiredpackage = self.GetPackage(build.user.username, build.project, row.packagename, build.branchname)
-      result = self.DoesPackageDependOnOtherPackage(dependantpackage, requiredpackage)
-      if result:
-        print("cannot build " + build.packagename + " because it depends on another package")
-        return True
+    # packages that are waiting or building on the same queue (same user, project, branch, distro, release, arch)
+    queuedpackages = Build.objects.filter(Q(Q(status='WAITING') | Q(status='BUILDING'))). \
+        filter(user=build.user). \
+        filter(project=build.project). \
+        filter(branchname=build.branchname). \
+        filter(distro=build.distro). \
+        filter(release=build.release). \
+        filter(arch=build.arch). \
+        filter(hanging=False). \
+        exclude(pk=build.pk). \
+        values('package')
+    # does this package actually depend on one of those packages?
+    dependancies = PackageDependancyClosure.objects. \
+        filter(dependantpackage__project__user=build.user). \
+        filter(dependantpackage__project__name=build.project). \
+        filter(dependantpackage__name=build.package). \
+        filter(requiredpackage__name__in=queuedpackages)
+    if dependancies.exists():
+      print("cannot build " + build.package + " because it depends on another package")
+      return True
     return False
 
   def CanFindMachineBuildingProject(self, username, projectname):
@@ -182,144 +246,188 @@ class LightBuildServer:
     project = Project.objects.filter(name=build.project).filter(user=build.user).first()
     lbsproject = project.git_url
     git_project_name = project.git_url.strip('/').split('/')[-1]
-    pathSrc = settings.GIT_SRC_PATH+"/"+build.user.username+"/"
-
-    # first try with git branch master, to see if the branch is decided in the setup.sh. then there must be a config.yml
-    self.getPackagingInstructionsInternal(project, build, project.git_branch, lbsproject, git_project_name, pathSrc)
 
-    if not os.path.isfile(pathSrc+git_project_name+"/config.yml"):
-      self.getPackagingInstructionsInternal(project, build, build.branchname, lbsproject, git_project_name, pathSrc)
-    return pathSrc
-
-  def getPackagingInstructionsInternal(self, project, build, branchname, lbsproject, git_project_name, pathSrc):
-    os.makedirs(pathSrc, exist_ok=True)
-
-    needToDownload = True
-
-    #we want a clean clone
-    #but do not delete the tree if it is being used by another build
-    t = None
-    if os.path.isfile(pathSrc+git_project_name+'-lastused'):
-      t = os.path.getmtime(pathSrc+git_project_name+'-lastused')
-      # delete the tree only if it has not been used within the last 3 minutes
-      if (time.time() - t) < 3*60:
-        needToDownload = False
-      # update the timestamp
-      os.utime(pathSrc+git_project_name+'-lastused')
+    # only the tree of the branch with the packaging instructions is used
+    (branchname, snapshotid, mirror) = self.resolveBranch(project, build.branchname, lbsproject, git_project_name)
+    return self.getPackagingInstructionsInternal(project, build, branchname, lbsproject, git_project_name, snapshotid, mirror)
+
+  def resolveBranch(self, project, branchname, lbsproject, git_project_name):
+    # if there is a config.yml in git branch master, the branch is decided in the setup.sh.
+    # this is cached per revision of git branch master, see SourceSnapshots.GetConfigRef.
+    # returns the branch, and the snapshot or the updated git mirror if they have already been fetched
+    if branchname == project.git_branch:
+      return (branchname, None, None)
+    snapshotid = None
+    mirror = None
+    ref = SourceSnapshots.GetConfigRef(lbsproject, project.git_branch)
+    if ref is not None and (time.time() - ref['checked']) < 3*60:
+      hasconfig = ref['config']
+    elif project.git_mirror:
+      # the mirror can look at the commit, without unpacking the tree
+      mirror = GitMirror(lbsproject, project.git_private_token)
+      mirror.update()
+      revision = mirror.resolve(project.git_branch)
+      if ref is not None and ref['revision'] == revision:
+        hasconfig = ref['config']
+      else:
+        hasconfig = mirror.hasfile("config.yml")
+      SourceSnapshots.SetConfigRef(lbsproject, project.git_branch, revision, hasconfig)
     else:
-      open(pathSrc+git_project_name+'-lastused', 'a').close()
-
+      # only ask the git server for the file, instead of downloading the archive of the branch
+      revision = None
+      hasconfig = self.hasConfigFile(project, project.git_branch)
+      if hasconfig is None:
+        # the git server cannot tell us, so we need the tree
+        snapshotid = self.getSnapshotFromArchive(project, project.git_branch, lbsproject, git_project_name)
+        revision = snapshotid
+        hasconfig = os.path.isfile(SourceSnapshots.GetPath(snapshotid) + "/" + git_project_name + "/config.yml")
+      SourceSnapshots.SetConfigRef(lbsproject, project.git_branch, revision, hasconfig)
+    if hasconfig:
+      return (project.git_branch, snapshotid, mirror)
+    return (branchname, None, mirror)
+
+  def hasConfigFile(self, project, branchname):
+    # returns True or False, or None if the git server did not answer as expected
+    url = project.git_url.strip('/')
     headers = {}
-    url = None
     if project.git_type == 'gitea':
-      url = lbsproject + "/archive/" + branchname + ".tar.gz"
+      url = url + "/raw/branch/" + branchname + "/config.yml"
     elif project.git_type == 'github':
-      url = lbsproject + "/archive/" + branchname + ".tar.gz"
+      # redirects to raw.githubusercontent.com
+      url = url + "/raw/" + branchname + "/config.yml"
     elif project.git_type == 'gitlab':
-      url = lbsproject + "/repository/archive.tar.gz?ref=" + branchname
+      (server, path) = url.split("://", 1)[-1].split("/", 1)
+      url = url[:url.index(server) + len(server)] + "/api/v4/projects/" + urllib.parse.quote(path, safe='') + \
+          "/repository/files/config.yml/raw?ref=" + urllib.parse.quote(branchname, safe='')
       if project.git_private_token:
         headers['PRIVATE-TOKEN'] = project.git_private_token
+    else:
+      return None
+    try:
+      r = requests.head(url, headers=headers, allow_redirects=True, timeout=30)
+    except requests.RequestException as e:
+      print("hasConfigFile: problem with " + url + ": " + str(e))
+      return None
+    if r.status_code == 404:
+      return False
+    # a login page is not the file
+    if r.status_code == 200 and not r.headers.get('Content-Type', '').startswith('text/html'):
+      return True
+    return None
 
-    # check if the version we have is still uptodate
-    etagFile = pathSrc+git_project_name+'-etag'
-    if needToDownload and os.path.isfile(etagFile):
-      with open(etagFile, 'r') as content_file:
-        Etag = content_file.read()
-        headers['If-None-Match'] = Etag
-      r = requests.get(url, headers=headers)
-      if 'Etag' in r.headers and r.headers['Etag'] == '"' + Etag + '"':
-         needToDownload = False
-
-    if not needToDownload and os.path.isdir(pathSrc+git_project_name):
-      # we can reuse the existing source, it was used just recently, or has not changed on the server
-      self.StorePackageHashes(pathSrc+git_project_name, project, branchname)
-      return
-
-    # delete the working tree
-    if os.path.isdir(pathSrc+git_project_name):
-      shutil.rmtree(pathSrc+git_project_name)
-
-    sourceFile = f"{pathSrc}/{branchname}.tar.gz"
-    if os.path.isfile(sourceFile):
-      os.remove(sourceFile)
-    r = requests.get(url, headers=headers)
-    if r.status_code == 401:
-      raise Exception("problem downloading the repository, access denied")
-    elif not r.status_code == 200:
-      raise Exception("problem downloading the repository " + url + ", HTTP error code " + str(r.status_code))
-
-    chunk_size = 100000
-    with open(sourceFile, 'wb') as fd:
-      for chunk in r.iter_content(chunk_size):
-        fd.write(chunk)
-    if 'Etag' in r.headers:
-      Etag = r.headers['Etag']
-      with open(etagFile, 'w') as fd:
-        fd.write(Etag.strip('"'))
-
-    shell = Shell(Logger())
-    if project.git_type == 'gitea':
-      cmd="cd " + pathSrc + ";"
-      cmd+=f"tar xzf {branchname}.tar.gz"
-      shell.executeshell(cmd)
-    elif project.git_type == 'github':
-      cmd="cd " + pathSrc + ";"
-      cmd+=f"tar xzf {branchname}.tar.gz; mv {git_project_name}-{branchname} {git_project_name}"
-      shell.executeshell(cmd)
-    elif project.git_type == 'gitlab':
-      cmd="cd " + pathSrc + ";"
-      cmd+=f"tar xzf {branchname}.tar.gz; mv {git_project_name}-{branchname}-* {git_project_name}"
-      shell.executeshell(cmd)
+  def getPackagingInstructionsInternal(self, project, build, branchname, lbsproject, git_project_name, snapshotid = None, mirror = None):
+    # the sources are in a snapshot that is shared with other builds of the same version, see SourceSnapshots.
+    # returns the path of the snapshot, that contains the tree as git_project_name
+    if snapshotid is None and project.git_mirror:
+      snapshotid = self.getSnapshotFromMirror(project, branchname, lbsproject, git_project_name, mirror)
+    elif snapshotid is None:
+      snapshotid = self.getSnapshotFromArchive(project, branchname, lbsproject, git_project_name)
 
-    if os.path.isfile(sourceFile):
-      os.remove(sourceFile)
-    if not os.path.isdir(pathSrc+git_project_name):
+    if not os.path.isdir(SourceSnapshots.GetPath(snapshotid) + "/" + git_project_name):
       raise Exception("Problem with cloning the git repo")
 
-    self.StorePackageHashes(pathSrc+git_project_name, project, branchname)
-
-  def StorePackageHashes(self, projectPathSrc, project, branchname):
-    shell = Shell(Logger())
-    for dir in os.listdir(projectPathSrc):
-      if os.path.isdir(projectPathSrc + "/" + dir):
-        packagename = os.path.basename(dir)
-        # update hash of each package
-        cmd = "find " + projectPathSrc + "/" + dir + " -type f -print0 | sort -z | xargs -0 sha1sum | sha1sum | awk '{print $1}'"
-        sourcehash = shell.evaluateshell(cmd)
-        # print(packagename + " " + hash)
-        package = Package.objects.filter(project = project).filter(name=packagename).first()
-        if package:
-          hash, created = PackageSrcHash.objects.get_or_create(package=package,branchname=branchname)
-          if not hash.sourcehash == sourcehash:
-            hash.sourcehash = sourcehash
-            hash.save()
-            if not created:
-                self.MarkPackageAsDirty(package, branchname)
+    # the build is pinned to the snapshot, so that the snapshot is not deleted while the build is running
+    SourceSnapshots.Touch(snapshotid)
+    build.sourcesnapshot = snapshotid
+    if build.id:
+      Build.objects.filter(pk=build.id).update(sourcesnapshot=snapshotid)
+
+    pathSrc = SourceSnapshots.GetPath(snapshotid) + "/"
+    self.StorePackageHashes(pathSrc+git_project_name, project, branchname, snapshotid)
+    return pathSrc
+
+  def getSnapshotFromArchive(self, project, branchname, lbsproject, git_project_name):
+    headers = {}
+    url = SourceSnapshots.GetRefUrl(project, branchname)
+    if project.git_type == 'gitlab' and project.git_private_token:
+      headers['PRIVATE-TOKEN'] = project.git_private_token
+
+    ref = SourceSnapshots.GetRef(url)
+    if ref is not None and (time.time() - ref['checked']) < 3*60:
+      # we can reuse the snapshot, it was checked just recently
+      return ref['snapshot']
+
+    # one conditional request: the archive is only downloaded if it has changed on the server,
+    # and it is unpacked while downloading
+    fetcher = SourceFetcher(url, headers)
+    if ref is not None and ref['version'] and not fetcher.request(ref['version']):
+      snapshotid = ref['snapshot']
+      etag = ref['version']
+    else:
+      if fetcher.response is None:
+        fetcher.request()
+      try:
+        etag = fetcher.etag
+        # without Etag, each download is a new snapshot
+        snapshotid = SourceSnapshots.GetId(url, etag or str(time.time()))
+        SourceSnapshots.Create(snapshotid, fetcher, git_project_name)
+      finally:
+        fetcher.close()
+    SourceSnapshots.SetRef(url, etag, snapshotid)
+    return snapshotid
+
+  def getSnapshotFromMirror(self, project, branchname, lbsproject, git_project_name, mirror = None):
+    # the local mirror only fetches the new commits, and the commit is the version of the snapshot.
+    # mirror has just been updated, see resolveBranch
+    refurl = SourceSnapshots.GetRefUrl(project, branchname)
+    if mirror is None:
+      ref = SourceSnapshots.GetRef(refurl)
+      if ref is not None and (time.time() - ref['checked']) < 3*60:
+        return ref['snapshot']
+      mirror = GitMirror(lbsproject, project.git_private_token)
+      mirror.update()
+    commit = mirror.resolve(branchname)
+    snapshotid = SourceSnapshots.GetId(lbsproject, commit)
+    SourceSnapshots.Create(snapshotid, mirror, git_project_name)
+    SourceSnapshots.SetRef(refurl, commit, snapshotid)
+    return snapshotid
+
+  def StorePackageHashes(self, projectPathSrc, project, branchname, snapshotid):
+    packages = {package.name: package for package in Package.objects.filter(project = project)}
+    dirs = [dir for dir in os.listdir(projectPathSrc) if dir in packages and os.path.isdir(projectPathSrc + "/" + dir)]
+    # the hashes contain the path of the checkout that was used before the snapshots,
+    # so that the hashes of unchanged packages stay the same
+    checkoutPath = settings.GIT_SRC_PATH + "/" + project.user.username + "/" + os.path.basename(projectPathSrc)
+    names = {dir: checkoutPath + "/" + dir for dir in dirs}
+    knownhashes = SourceSnapshots.GetHashes(snapshotid)
+    missing = [dir for dir in dirs if names[dir] not in knownhashes]
+    if missing:
+      for dir, sourcehash in zip(missing, SourceHasher.get().hashdirectories([(projectPathSrc + "/" + dir, names[dir]) for dir in missing])):
+        knownhashes[names[dir]] = sourcehash
+      SourceSnapshots.SetHashes(snapshotid, knownhashes)
+    sourcehashes = [knownhashes[names[dir]] for dir in dirs]
+
+    hashes = {hash.package_id: hash for hash in PackageSrcHash.objects.filter(package__in = [packages[dir] for dir in dirs], branchname = branchname)}
+    newhashes = []
+    changedhashes = []
+    for dir, sourcehash in zip(dirs, sourcehashes):
+      package = packages[dir]
+      hash = hashes.get(package.id)
+      if hash is None:
+        newhashes.append(PackageSrcHash(package = package, branchname = branchname, sourcehash = sourcehash))
+      # older hashes end with a newline, from the output of sha1sum
+      elif not hash.sourcehash.strip() == sourcehash:
+        hash.sourcehash = sourcehash
+        changedhashes.append(hash)
+    PackageSrcHash.objects.bulk_create(newhashes)
+    PackageSrcHash.objects.bulk_update(changedhashes, ['sourcehash'])
+    for hash in changedhashes:
+      self.MarkPackageAsDirty(hash.package, branchname)
 
   # this changes the status of the package, and requires itself and all depending packages to be rebuilt
   def MarkPackageAsDirty(self, package, branchname):
-    # invalidate the package on all distros/release/arch combinations
-    packagebuildstatus = PackageBuildStatus.objects.filter(package=package).filter(branchname=branchname)
-    for p in packagebuildstatus:
-        p.dirty = True
-        p.save()
-
     # find all packages depending on it, and invalidate their builds as well
-    packagedependancy = PackageDependancy.objects.filter(requiredpackage=package)
-    for p in packagedependancy:
-      otherpackagebuildstatus = PackageBuildStatus.objects.filter(package = p.dependantpackage). \
-        filter(branchname=packagebuildstatus.branchname).first()
-      if otherpackagebuildstatus:
-        self.MarkPackageAsDirty(otherpackagebuildstatus, branchname)
-
-  def MarkProjectAsDirty(self, username, projectname, branchname, distro, release, arch):
-    project = Project.objects.filter(user__username=username).filter(name=projectname).first()
-    packagebuildstatus = PackageBuildStatus.objects.filter(package=project.package). \
+    dependantpackages = PackageDependancyClosure.objects.filter(requiredpackage=package).values('dependantpackage')
+    # invalidate the packages on all distros/release/arch combinations
+    PackageBuildStatus.objects.filter(branchname=branchname). \
+        filter(Q(package=package) | Q(package__in=dependantpackages)). \
+        update(dirty=True)
+
+  def MarkProjectAsDirty(self, project, branchname, distro, release, arch):
+    PackageBuildStatus.objects.filter(package__project=project). \
         filter(branchname=branchname). \
-        filter(distro=distro).filter(release=release).filter(arch=arch)
-    for p in packagebuildstatus:
-      packagebuildstatus.dirty = True
-      packagebuildstatus.save()
+        filter(distro=distro).filter(release=release).filter(arch=arch). \
+        update(dirty=True)
 
   def MarkPackageAsBuilt(self, build):
     project = Project.objects.filter(user__username=build.user.username).filter(name=build.project).first()
@@ -336,44 +444,39 @@ class LightBuildServer:
         packagebuildstatus.save()
 
   def GetPackage(self, username, projectname, packagename, branchname):
-    package = Package.objects.filter(projectname=projectname).filter(packagename=packagename).filter(branchname=branchname).first()
+    package = Package.objects.filter(project__user__username=username).filter(project__name=projectname).filter(name=packagename).first()
     return package
 
   def DoesPackageDependOnOtherPackage(self, dependantpackage, requiredpackage):
     if requiredpackage is not None and dependantpackage is not None:
-      # find all packages that this package depends on, recursively
-      dep = PackageDependancy.objects.filter(dependantpackage=dependantpackage)
-      if not dep is None:
-        for row in dep:
-          if row.requiredpackage == requiredpackage:
-            print(f"DoesPackageDependOnOtherPackage: {dependantpackage.id} depends on {requiredpackage.id}")
-            return True
-          if self.DoesPackageDependOnOtherPackage(row.requiredpackage, requiredpackage):
-            return True
+      # the closure contains all packages that this package depends on, recursively
+      if PackageDependancyClosure.objects.filter(dependantpackage=dependantpackage).filter(requiredpackage=requiredpackage).exists():
+        print(f"DoesPackageDependOnOtherPackage: {dependantpackage.id} depends on {requiredpackage.id}")
+        return True
     return False
 
   # Returns True or False
-  def NeedToRebuildPackage(self, username, projectname, packagename, branchname, distro, release, arch):
-    result = True
-    cursor = con.execute("SELECT * FROM package WHERE username = ? AND projectname = ? AND packagename = ? AND branchname = ?", (username, projectname, packagename, branchname))
-    row = cursor.fetchone()
-    if row is not None:
-      packageid = row['id']
-      stmt = "SELECT dirty FROM packagebuildstatus WHERE packageid = ? AND distro = ? AND release = ? AND arch = ? AND dirty = 0"
-      cursor = con.execute(stmt, (packageid, distro, release, arch))
-      row = cursor.fetchone()
-      if row is not None:
-        print(" no need to rebuild " + packagename + " " + str(packageid))
-        result = False
-    return result
+  def NeedToRebuildPackage(self, project, packagename, branchname, distro, release, arch):
+    packagebuildstatus = PackageBuildStatus.objects.filter(package__project=project). \
+        filter(package__name=packagename). \
+        filter(branchname=branchname). \
+        filter(distro=distro).filter(release=release).filter(arch=arch). \
+        filter(dirty=False)
+    if packagebuildstatus.exists():
+      print(" no need to rebuild " + packagename)
+      return False
+    return True
 
+  # returns the packages in levels, see BuildHelper.CalculatePackageGraph
   def CalculatePackageOrder(self, project, branchname, distro, release, arch):
+    build = Build(user=project.user, project=project.name, package=None, branchname=branchname, distro=distro, release=release, arch=arch)
+
     # get the sources of the packaging instructions
-    self.getPackagingInstructions(project, branchname)
+    self.getPackagingInstructions(build)
 
-    build = Build(project=project, package=None, branchname=branchname, distro=distro, release=release, arch=arch)
     buildHelper = BuildHelperFactory.GetBuildHelper(distro, None, build)
-    return buildHelper.CalculatePackageOrder(distro, release, arch)
+    (levels, requires) = buildHelper.CalculatePackageGraph(distro, release, arch)
+    return levels
 
   def AddToBuildQueue(self, project, packagename, branchname, distro, release, arch):
     # find if this project depends on other projects
@@ -391,26 +494,32 @@ class LightBuildServer:
         avoiddocker=avoiddocker, avoidlxc=avoidlxc, designated_build_machine=buildmachine)
     build.save()
 
+    BuildScheduler.notify()
+
   def BuildProject(self, project, branchname, distro, release, arch, reset = False):
     if reset == True:
       self.MarkProjectAsDirty(project, branchname, distro, release, arch)
 
-    packages=self.CalculatePackageOrder(project, branchname, distro, release, arch)
+    levels=self.CalculatePackageOrder(project, branchname, distro, release, arch)
 
-    if packages is None:
+    if levels is None:
       message="Error: circular dependancy!"
     else:
       message=""
-      for packagename in packages:
+      # all packages are added to the queue at once.
+      # the scheduler starts each package as soon as the packages that it depends on have been built,
+      # so the packages of one level are built at the same time on all free machines.
+      for level in levels:
+        for packagename in level:
 
-        if not self.NeedToRebuildPackage(project, packagename, branchname, distro, release, arch):
-          continue
+          if not self.NeedToRebuildPackage(project, packagename, branchname, distro, release, arch):
+            continue
 
-        # add package to build queue
-        message += packagename + ", "
-        job = self.GetJob(project, packagename, branchname, distro, release, arch, True)
-        if job is None:
-          self.AddToBuildQueue(project, packagename, branchname, distro, release, arch)
+          # add package to build queue
+          message += packagename + ", "
+          job = self.GetJob(project, packagename, branchname, distro, release, arch, True)
+          if job is None:
+            self.AddToBuildQueue(project, packagename, branchname, distro, release, arch)
 
     return message
 
@@ -438,24 +547,37 @@ class LightBuildServer:
     # get name of available slot
     buildmachine=self.GetAvailableBuildMachine(build)
     if buildmachine:
+      # only start the build if no other scheduler has started it in the meantime
+      started = timezone.now()
+      supervisor = BuildSupervisor.get()
+      claimed = Build.objects.filter(pk=build.pk).filter(status='WAITING'). \
+          update(status='BUILDING', started=started, heartbeat=started, worker=supervisor.name)
+      if claimed != 1:
+        self.GiveBackBuildMachine(buildmachine, build)
+        return False
       build.status = 'BUILDING'
-      build.started = timezone.now()
+      build.started = started
+      build.worker = supervisor.name
       build.buildmachine = buildmachine
-      build.save()
-      thread = Thread(target = lbs.buildpackage, args = (build,))
-      thread.start()
+      supervisor.Start(lbs, build)
       return True
     return False
 
-  # needs to be called regularly from outside
+  # needs to be called regularly from outside, or by the BuildScheduler
   def ProcessBuildQueue(self):
       # loop from left to right
       # check if a project might be ready to build
-      builds = Build.objects.filter(status='WAITING')
+      # dispatch as many builds as there are free machines in one pass
+      builds = Build.objects.filter(status='WAITING').order_by('id')
       for build in builds:
-        if self.attemptToFindBuildMachine(build):
-          time.sleep(10)
-
+        if not Machine.objects.filter(status='AVAILABLE').filter(enabled=True).exists():
+          break
+        if not BuildSupervisor.get().HasCapacity():
+          # the BuildScheduler is notified when one of our builds has finished
+          break
+        self.attemptToFindBuildMachine(build)
+
+      self.ReconcileOrphanedBuilds()
       self.CheckForHangingBuild()
 
   def LiveLog(self, build):
@@ -463,22 +585,44 @@ class LightBuildServer:
         return ("No build is planned for this package at the moment...", -1)
       elif build.status == 'BUILDING':
         rowsToShow=40
-        logs = Log.objects.filter(build=build).order_by('-id')[:rowsToShow:-1]
-        output = ""
-        for row in logs:
-          output += row.line
+        cached = LiveLogCache.get(build.id, None, rowsToShow, rowsToShow)
+        if cached is not None:
+          output = cached[0]
+        else:
+          output = LogSpool(build.id).tail(rowsToShow)
         timeout = 2
       elif build.status == 'CANCELLED':
         return ("This build has been removed from the build queue...", -1)
       elif build.status == 'WAITING':
         return ("We are waiting for a build machine to become available...", 10)
       elif build.status == 'FINISHED':
-        output = Logger().getLog(build)
+        # the last page, the whole log is shown by viewlog
+        output = Logger().getLogArchive(build).tail(settings.LOG_PAGE_LINES)
         # stop refreshing
         timeout=-1
 
       return (output, timeout)
 
+  def LiveLogUpdate(self, build, line = None):
+      # returns only the lines since the given line, so that the client can append them.
+      # without a line, returns the last lines, like LiveLog
+      result = {'status': build.status, 'line': 0, 'output': ""}
+      if build.status == 'BUILDING':
+        # all viewers of the build get the same lines from the shared cache
+        cached = LiveLogCache.get(build.id, line, 40, settings.LIVELOG_MAX_LINES)
+        if cached is not None:
+          (result['output'], result['line']) = cached
+          return result
+        spool = LogSpool(build.id)
+        count = spool.countlines()
+        if line is None or line > count:
+          line = max(0, count - 40)
+        # do not send too much at once, the client asks again for the rest
+        toline = min(count, line + settings.LIVELOG_MAX_LINES)
+        result['output'] = spool.read(line, toline)
+        result['line'] = toline
+      return result
+
   def GetJob(self, project, packagename, branchname, distro, release, arch, only_waiting_or_building):
       build = Build.objects.filter(user=project.user).filter(project=project.name). \
         filter(package=packagename).filter(branchname=branchname).filter(distro=distro). \
@@ -515,6 +659,11 @@ class LightBuildServer:
     srcInstructions = {}
     winInstructions = {}
 
+    # the instructions are read from the latest snapshot of the sources
+    if SourceSnapshots.GetLatest(package.project, package.project.git_branch) is None:
+        self.getPackagingInstructions(Build(user=package.project.user, project=package.project.name, package=package.name,
+            branchname=package.project.git_branch, distro=None, release=None, arch=None))
+
     for buildtarget in package.get_buildtargets():
         tmpBuild = Build(user=package.project.user, project=package.project.name, package=package.name, branchname=None, \
             distro=buildtarget.split("/")[0], release=None, arch=None)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""LiveLogCache: the last lines of each running build in a shared cache, for the viewers of the live log"""
+
+# Copyright (c) 2014-2024 Timotheus Pokorra
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+# USA
+#
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.dummy import DummyCache
+
+class LiveLogCache:
+  'a ring buffer with the last LIVELOG_CACHE_LINES lines per build. only the LogWriter of the build adds lines'
+
+  # None until the cache has been checked, see getcache
+  cache = None
+  enabled = None
+
+  @staticmethod
+  def getcache():
+    # returns None if the cache is not enabled, or if it is not shared with the other processes
+    if LiveLogCache.enabled is None:
+      LiveLogCache.enabled = False
+      if settings.LIVELOG_CACHE:
+        cache = caches[settings.LIVELOG_CACHE]
+        if isinstance(cache, (LocMemCache, DummyCache)):
+          print("LiveLogCache: the cache " + settings.LIVELOG_CACHE + " is not shared by the processes, the live log is read from the spool files")
+        else:
+          LiveLogCache.cache = cache
+          LiveLogCache.enabled = True
+    return LiveLogCache.cache
+
+  @staticmethod
+  def getkey(buildid):
+    return "lbs-livelog-" + str(buildid)
+
+  @staticmethod
+  def add(buildid, lines, count):
+    # count is the number of lines in the spool file, including the new lines
+    cache = LiveLogCache.getcache()
+    if cache is None:
+      return
+    key = LiveLogCache.getkey(buildid)
+    entry = cache.get(key)
+    if entry is not None and entry['line'] == count - len(lines):
+      buffer = entry['lines'] + lines
+    else:
+      # new build, or the entry has been evicted. the spool file has the older lines
+      buffer = list(lines)
+    buffer = buffer[-settings.LIVELOG_CACHE_LINES:]
+    cache.set(key, {'line': count, 'lines': buffer}, settings.LIVELOG_CACHE_TIMEOUT)
+
+  @staticmethod
+  def get(buildid, line, tail, maxlines):
+    # returns (output, next line), or None if the lines are not in the cache.
+    # without a line, the output starts with the last tail lines
+    cache = LiveLogCache.getcache()
+    if cache is None:
+      return None
+    entry = cache.get(LiveLogCache.getkey(buildid))
+    if entry is None:
+      return None
+    count = entry['line']
+    first = count - len(entry['lines'])
+    if line is None or line > count:
+      line = max(0, count - tail)
+    if line < first:
+      return None
+    toline = min(count, line + maxlines)
+    return ("".join(entry['lines'][line - first:toline - first]), toline)
+
+  @staticmethod
+  def remove(buildid):
+    cache = LiveLogCache.getcache()
+    if cache is not None:
+      cache.delete(LiveLogCache.getkey(buildid))
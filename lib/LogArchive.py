@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""LogArchive: the log of a finished build, compressed in blocks, with an index for reading parts of it"""
+
+# Copyright (c) 2014-2024 Timotheus Pokorra
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+# USA
+#
+
+import os
+import gzip
+import json
+import bisect
+
+from django.conf import settings
+
+def splitlines(text):
+  # only split at the newline, like the browser does, and keep the newline
+  lines = text.split("\n")
+  result = [line + "\n" for line in lines[:-1]]
+  if lines[-1]:
+    result.append(lines[-1])
+  return result
+
+class LogArchive:
+  '''build-NNNNNN.log.gz consists of independent gzip members, so it can still be read with zcat.
+  build-NNNNNN.log.idx contains the offset, the first line and the first byte of the text of each member,
+  and the lines with LBSERROR.
+  older logs are plain text files, build-NNNNNN.log'''
+
+  def __init__(self, basename):
+    # eg. var/logs/user/project/package/branch/distro/release/arch/build-000001
+    self.plainfile = basename + ".log"
+    self.archivefile = basename + ".log.gz"
+    self.indexfile = basename + ".log.idx"
+    # the full output, if the log has been shortened, see Logger.limitvolume
+    self.fullfile = basename + ".full.log.gz"
+    self.index = None
+
+  def exists(self):
+    return os.path.isfile(self.archivefile) or os.path.isfile(self.plainfile)
+
+  def create(self, spool):
+    # compress the spool file of the build, block by block
+    blocklines = settings.LOG_ARCHIVE_BLOCK_LINES
+    count = spool.countlines()
+    index = {'blocks': [], 'lines': 0, 'bytes': 0, 'errors': []}
+    with open(self.archivefile + ".tmp", 'wb') as f:
+      for fromline in range(0, count, blocklines):
+        text = spool.read(fromline, fromline + blocklines)
+        index['blocks'].append([f.tell(), index['lines'], index['bytes']])
+        lines = splitlines(text)
+        for number, line in enumerate(lines, start=index['lines']):
+          if "LBSERROR" in line:
+            index['errors'].append(number)
+        index['lines'] += len(lines)
+        data = text.encode('utf-8')
+        index['bytes'] += len(data)
+        f.write(gzip.compress(data, compresslevel=6))
+    with open(self.indexfile, 'w') as f:
+      json.dump(index, f)
+    os.replace(self.archivefile + ".tmp", self.archivefile)
+    self.index = index
+
+  def getindex(self):
+    if self.index is None:
+      if os.path.isfile(self.archivefile) and os.path.isfile(self.indexfile):
+        with open(self.indexfile, 'r') as f:
+          self.index = json.load(f)
+      else:
+        # an older log, without index
+        lines = splitlines(self.readplain())
+        self.index = {'blocks': [], 'lines': len(lines), 'errors': [number for number, line in enumerate(lines) if "LBSERROR" in line]}
+    return self.index
+
+  def readplain(self):
+    if not os.path.isfile(self.plainfile):
+      return ""
+    with open(self.plainfile, 'r', encoding="utf-8", errors="replace") as f:
+      return f.read()
+
+  def countlines(self):
+    return self.getindex()['lines']
+
+  def geterrors(self):
+    # the numbers of the lines with LBSERROR, counting from 0
+    return self.getindex()['errors']
+
+  def read(self, fromline = 0, toline = None):
+    # returns the lines [fromline, toline) as one string, only decompressing the blocks that contain them
+    index = self.getindex()
+    if toline is None or toline > index['lines']:
+      toline = index['lines']
+    if fromline >= toline:
+      return ""
+    if not index['blocks']:
+      return "".join(splitlines(self.readplain())[fromline:toline])
+    firstlines = [block[1] for block in index['blocks']]
+    block = bisect.bisect_right(firstlines, fromline) - 1
+    output = []
+    with open(self.archivefile, 'rb') as f:
+      while block < len(index['blocks']) and index['blocks'][block][1] < toline:
+        (offset, firstline) = index['blocks'][block]
+        f.seek(offset)
+        if block + 1 < len(index['blocks']):
+          data = f.read(index['blocks'][block + 1][0] - offset)
+        else:
+          data = f.read()
+        lines = splitlines(gzip.decompress(data).decode('utf-8', errors='replace'))
+        output.extend(lines[max(0, fromline - firstline):toline - firstline])
+        block += 1
+    return "".join(output)
+
+  def getsize(self):
+    # the size of the decompressed log in bytes
+    index = self.getindex()
+    if 'bytes' not in index:
+      # the index of an older archive does not know the size yet
+      index['bytes'] = sum(len(chunk) for chunk in self.readbytes())
+    return index['bytes']
+
+  def readbytes(self, start = 0, end = None):
+    # yields the decompressed bytes [start, end] of the archive, only decompressing from the block that contains start
+    index = self.getindex()
+    offset = position = 0
+    if index['blocks'] and len(index['blocks'][0]) > 2:
+      block = bisect.bisect_right([block[2] for block in index['blocks']], start) - 1
+      offset = index['blocks'][block][0]
+      position = index['blocks'][block][2]
+    with open(self.archivefile, 'rb') as raw:
+      raw.seek(offset)
+      with gzip.GzipFile(fileobj=raw, mode='rb') as f:
+        while end is None or position <= end:
+          chunk = f.read(65536)
+          if not chunk:
+            break
+          if position + len(chunk) > start:
+            yield chunk[max(0, start - position):None if end is None else end + 1 - position]
+          position += len(chunk)
+
+  def tail(self, lines):
+    count = self.countlines()
+    return self.read(max(0, count - lines), count)
+
+  def remove(self):
+    for filename in (self.plainfile, self.archivefile, self.indexfile, self.fullfile):
+      if os.path.exists(filename):
+        os.remove(filename)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""LogSpool: the live log of a running build, in an append-only file with an index of the line offsets"""
+
+# Copyright (c) 2014-2024 Timotheus Pokorra
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+# USA
+#
+
+import os
+import struct
+from pathlib import Path
+
+from django.conf import settings
+
+class LogSpool:
+  'the lines of one build. the index file contains the byte offset of the end of each line in the log file'
+
+  # one unsigned 64 bit integer per line
+  OFFSET = struct.Struct("<Q")
+
+  def __init__(self, buildid):
+    self.logfile = settings.LOG_SPOOL_PATH + "/" + str(buildid) + ".log"
+    self.indexfile = settings.LOG_SPOOL_PATH + "/" + str(buildid) + ".idx"
+    # all lines of the build, if some of them are not kept in the log, see Logger.limitvolume
+    self.fullfile = settings.LOG_SPOOL_PATH + "/" + str(buildid) + ".full.gz"
+    # the last lines of a shortened log, until they are written at the end of the build
+    self.tailfile = settings.LOG_SPOOL_PATH + "/" + str(buildid) + ".tail"
+
+  def exists(self):
+    return os.path.isfile(self.logfile)
+
+  def append(self, lines):
+    # only called by the LogWriter, so there is only one writer per build.
+    # the lines are written before their offsets, so a reader only sees complete lines
+    if not os.path.isdir(settings.LOG_SPOOL_PATH):
+      Path(settings.LOG_SPOOL_PATH).mkdir(parents=True, exist_ok=True)
+    offsets = []
+    with open(self.logfile, 'ab') as f:
+      offset = f.tell()
+      data = []
+      for line in lines:
+        encoded = line.encode('utf-8', errors='replace')
+        offset += len(encoded)
+        offsets.append(self.OFFSET.pack(offset))
+        data.append(encoded)
+      f.write(b"".join(data))
+    with open(self.indexfile, 'ab') as f:
+      f.write(b"".join(offsets))
+
+  def countlines(self):
+    try:
+      return os.path.getsize(self.indexfile) // self.OFFSET.size
+    except OSError:
+      return 0
+
+  def getoffset(self, line):
+    # the byte offset where the given line starts, counting from 0.
+    # the index contains the offset where each line ends
+    if line == 0:
+      return 0
+    with open(self.indexfile, 'rb') as f:
+      f.seek((line - 1) * self.OFFSET.size)
+      return self.OFFSET.unpack(f.read(self.OFFSET.size))[0]
+
+  def read(self, fromline = 0, toline = None):
+    # returns the lines [fromline, toline) as one string
+    count = self.countlines()
+    if toline is None or toline > count:
+      toline = count
+    if fromline >= toline:
+      return ""
+    start = self.getoffset(fromline)
+    with open(self.logfile, 'rb') as f:
+      f.seek(start)
+      data = f.read(self.getoffset(toline) - start)
+    return data.decode('utf-8', errors='replace')
+
+  def tail(self, lines):
+    # the last lines, without reading the whole log
+    count = self.countlines()
+    return self.read(max(0, count - lines), count)
+
+  def remove(self):
+    for filename in (self.logfile, self.indexfile, self.fullfile, self.tailfile):
+      if os.path.exists(filename):
+        os.remove(filename)
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""LogWriter: write the output of all builds of this process to the spool files in batches"""
+
+# Copyright (c) 2014-2024 Timotheus Pokorra
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+# USA
+#
+
+import time
+import traceback
+from threading import Thread, Lock, Condition
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from builder.models import Build
+from lib.LogSpool import LogSpool
+from lib.LiveLogCache import LiveLogCache
+
+class LogWriter:
+  'collect the lines of all Logger instances, and write them every LOG_FLUSH_INTERVAL seconds'
+
+  instance = None
+  instanceLock = Lock()
+
+  @staticmethod
+  def get():
+    with LogWriter.instanceLock:
+      if LogWriter.instance is None:
+        LogWriter.instance = LogWriter(settings.LOG_FLUSH_INTERVAL, settings.LOG_FLUSH_SIZE)
+      return LogWriter.instance
+
+  def __init__(self, interval, size):
+    self.interval = interval
+    self.size = size
+    # the lines per build id
+    self.pending = {}
+    self.pendingLines = 0
+    self.oldestPending = None
+    self.condition = Condition()
+    # only one flush at a time, either by the thread or by Flush
+    self.flushLock = Lock()
+    self.stats = {'lines': 0, 'flushes': 0, 'errors': 0,
+        'lastflushlines': 0, 'lastflushseconds': 0.0, 'maxflushseconds': 0.0, 'maxlatencyseconds': 0.0}
+    self.thread = Thread(target = self.run, daemon = True)
+    self.thread.start()
+
+  def add(self, build, lines):
+    # called by the Logger, the lines are written later
+    with self.condition:
+      if not self.pending:
+        self.oldestPending = time.monotonic()
+      self.pending.setdefault(build.id, []).extend(lines)
+      self.pendingLines += len(lines)
+      if self.pendingLines >= self.size:
+        self.condition.notify()
+
+  def run(self):
+    while True:
+      with self.condition:
+        self.condition.wait_for(lambda: self.pendingLines >= self.size, timeout = self.interval)
+      try:
+        self.Flush()
+      except Exception as e:
+        self.stats['errors'] += 1
+        print("LogWriter: problem writing the log: " + str(e))
+        traceback.print_exc()
+      finally:
+        # this thread runs forever, so we must not keep a database connection that has timed out
+        close_old_connections()
+
+  def Flush(self):
+    # write all pending lines now, eg. before the log of a build is read
+    with self.flushLock:
+      with self.condition:
+        pending = self.pending
+        count = self.pendingLines
+        oldest = self.oldestPending
+        self.pending = {}
+        self.pendingLines = 0
+      if not pending:
+        return
+      start = time.monotonic()
+      failed = {}
+      for buildid, lines in pending.items():
+        try:
+          spool = LogSpool(buildid)
+          spool.append(lines)
+        except Exception as e:
+          print("LogWriter: problem writing the log of build " + str(buildid) + ": " + str(e))
+          failed[buildid] = lines
+          continue
+        try:
+          LiveLogCache.add(buildid, lines, spool.countlines())
+        except Exception as e:
+          # the viewers read the spool file instead
+          print("LogWriter: problem with the live log cache of build " + str(buildid) + ": " + str(e))
+      # the builds are still alive, see LightBuildServer.CheckForHangingBuild
+      Build.objects.filter(pk__in = [buildid for buildid in pending if not buildid in failed]).update(heartbeat = timezone.now())
+      end = time.monotonic()
+      if failed:
+        # try again with the next flush
+        with self.condition:
+          for buildid, lines in failed.items():
+            self.pending[buildid] = lines + self.pending.get(buildid, [])
+            self.pendingLines += len(lines)
+          self.oldestPending = oldest
+        count -= sum(len(lines) for lines in failed.values())
+        self.stats['errors'] += 1
+      self.stats['lines'] += count
+      self.stats['flushes'] += 1
+      self.stats['lastflushlines'] = count
+      self.stats['lastflushseconds'] = end - start
+      self.stats['maxflushseconds'] = max(self.stats['maxflushseconds'], end - start)
+      self.stats['maxlatencyseconds'] = max(self.stats['maxlatencyseconds'], end - oldest)
+      if end - start > self.interval:
+        print("LogWriter: slow flush of " + str(count) + " lines for " + str(len(pending)) + " builds: " +
+            str(round(end - start, 2)) + " seconds")
+
+  def GetStats(self):
+    with self.condition:
+      result = dict(self.stats)
+      result['pending'] = self.pendingLines
+    return result
@@ -25,6 +25,8 @@ import datetime
 import smtplib
 from smtplib import SMTP_SSL
 import os
+import gzip
+import shutil
 from pathlib import Path
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
@@ -35,13 +37,16 @@ from django.conf import settings
 from django.utils import timezone
 from django.utils.timezone import make_aware
 
-from builder.models import Build, Log
+from builder.models import Build
+from lib.LogWriter import LogWriter
+from lib.LogSpool import LogSpool
+from lib.LiveLogCache import LiveLogCache
+from lib.LogArchive import LogArchive
 
 class Logger:
   'collect all the output'
 
   def __init__(self, build=None):
-    self.lastTimeUpdate = timezone.now()
     self.startTimer()
     self.logspath = settings.LOGS_PATH
     self.emailserver = settings.EMAIL_SERVER
@@ -49,14 +54,26 @@ class Logger:
     self.emailuser = settings.EMAIL_USER
     self.emailpassword = settings.EMAIL_PASSWORD
     self.build = build
+    # after the log has been stored, the lines are only shown on the console
+    self.stored = False
     self.MaxDebugLevel = settings.MAX_DEBUG_LEVEL
 
   def startTimer(self):
     self.starttime = timezone.now()
-    self.linebuffer = []
     self.buffer = ""
     self.error = False
     self.lastLine = ""
+    # see limitvolume
+    self.limitVolume = True
+    self.headLines = 0
+    self.headBytes = 0
+    self.tail = None
+    self.tailLines = 0
+    self.tailBytes = 0
+    self.elidedLines = 0
+    self.elidedBytes = 0
+    self.elidedErrors = False
+    self.fulloutput = None
 
   def print(self, newOutput, DebugLevel=1):
     if len(newOutput) == 1 and newOutput != "\n":
@@ -65,35 +82,41 @@ class Logger:
       if len(self.buffer) > 0:
         newOutput = self.buffer + newOutput
         self.buffer = ""
-      self.lastLine = newOutput
-      if newOutput[-1:] != "\n":
-        newOutput += "\n"
-      timeseconds = round((timezone.now() - self.starttime).total_seconds())
-      timeprefix = "[" + str(int(timeseconds/60/60)).zfill(2) + ":" + str(int(timeseconds/60)%60).zfill(2) + ":" + str(timeseconds%60).zfill(2)  + "] "
-      if "LBSERROR" in newOutput:
+      self.printlines([newOutput], DebugLevel)
+
+  def printlines(self, lines, DebugLevel=1):
+    # add several lines at once, eg. the output of a shell command
+    if not lines:
+      return
+    self.lastLine = lines[-1]
+    timeseconds = round((timezone.now() - self.starttime).total_seconds())
+    timeprefix = "[" + str(int(timeseconds/60/60)).zfill(2) + ":" + str(int(timeseconds/60)%60).zfill(2) + ":" + str(timeseconds%60).zfill(2)  + "] "
+    output = []
+    errors = []
+    for line in lines:
+      if line[-1:] != "\n":
+        line += "\n"
+      if "LBSERROR" in line:
         self.error = True
-      self.linebuffer.append(timeprefix + newOutput)
-
-      # only write new lines every other second, to avoid putting locks on the database
-      # also write often enough, do not collect too many lines
-      if self.build and ((timezone.now() - self.lastTimeUpdate).total_seconds() > 2 or len(self.linebuffer) > 20):
-
-        # write the lines to database, and then dump to file when build is finished
-        for line in self.linebuffer:
-            log = Log(build = self.build, line = line, created = timezone.now())
-            log.save()
-        self.linebuffer = []
-      self.lastTimeUpdate = timezone.now()
-
-      # sometimes we get incomplete bytes, and would get an ordinal not in range error
-      # just ignore the exception...
-      try:
-        if DebugLevel <= self.MaxDebugLevel:
-          print(timeprefix + newOutput)
-      except BlockingIOError:
-        print("Logging print: problem with writing to stdout")
-      finally:
-        sys.stdout.flush() 
+        errors.append(timeprefix + line)
+      output.append(timeprefix + line)
+    if self.build and not self.stored:
+      # the LogWriter writes the lines of all builds of this process in one go.
+      # it also reports the heartbeat of the build, even if all lines are kept back
+      LogWriter.get().add(self.build, self.limitvolume(output))
+
+    # sometimes we get incomplete bytes, and would get an ordinal not in range error
+    # just ignore the exception...
+    try:
+      if DebugLevel <= self.MaxDebugLevel:
+        sys.stdout.write("".join(output))
+      elif errors:
+        # errors are always shown
+        sys.stdout.write("".join(errors))
+    except BlockingIOError:
+      print("Logging print: problem with writing to stdout")
+    finally:
+      sys.stdout.flush()
 
   def hasLBSERROR(self):
     return self.error
@@ -105,15 +128,19 @@ class Logger:
     if not self.build:
       return "no log available"
 
-    log = Log.objects.filter(build = self.build)
-    if limit is not None and len(log) > limit:
-      # get the last lines
-      log = log[len(log)-limit:]
-    output = ""
-    for row in log:
-       output += row.line
-
-    return output
+    LogWriter.get().Flush()
+    spool = LogSpool(self.build.id)
+    if spool.exists():
+      if limit is not None:
+        # get the last lines
+        return spool.tail(limit)
+      return spool.read()
+    if self.stored:
+      archive = self.getLogArchive(self.build)
+      if limit is not None:
+        return archive.tail(limit)
+      return archive.read()
+    return ""
 
   def email(self, fromAddress, toAddress, subject, logurl):
     if self.hasLBSERROR():
@@ -135,41 +162,133 @@ class Logger:
     finally:
       server.quit()
 
+  def getlimits(self):
+    # the number of lines and bytes for the head and for the tail of the log
+    return ((settings.LOG_MAX_LINES or sys.maxsize) // 2, (settings.LOG_MAX_BYTES or sys.maxsize) // 2)
+
+  def limitvolume(self, lines):
+    # keep the first and the last LOG_MAX_LINES/2 lines or LOG_MAX_BYTES/2 bytes of the build,
+    # and drop the lines in between. the lines at the end are kept in the tail file of the spool,
+    # and are only written when the log is stored
+    if not self.limitVolume:
+      return lines
+    if settings.LOG_KEEP_FULL_OUTPUT:
+      if self.fulloutput is None:
+        spool = LogSpool(self.build.id)
+        Path(settings.LOG_SPOOL_PATH).mkdir(parents=True, exist_ok=True)
+        self.fulloutput = gzip.open(spool.fullfile, 'ab', compresslevel=6)
+      self.fulloutput.write("".join(lines).encode('utf-8', errors='replace'))
+    if not settings.LOG_MAX_LINES and not settings.LOG_MAX_BYTES:
+      return lines
+    (maxlines, maxbytes) = self.getlimits()
+    result = []
+    for line in lines:
+      encoded = line.encode('utf-8', errors='replace')
+      if self.tail is None:
+        if self.headLines < maxlines and self.headBytes + len(encoded) <= maxbytes:
+          self.headLines += 1
+          self.headBytes += len(encoded)
+          result.append(line)
+          continue
+        Path(settings.LOG_SPOOL_PATH).mkdir(parents=True, exist_ok=True)
+        self.tail = open(LogSpool(self.build.id).tailfile, 'w+b')
+        result.append("LBS: the output of this build is too long, the following lines will only be written at the end of the build\n")
+      self.tail.write(encoded)
+      self.tailLines += 1
+      self.tailBytes += len(encoded)
+    if self.tail is not None and (self.tailLines > 2 * maxlines or self.tailBytes > 2 * maxbytes):
+      self.compacttail(maxlines, maxbytes)
+    return result
+
+  def compacttail(self, maxlines, maxbytes):
+    # drop the oldest lines of the tail file, without reading the whole file into memory
+    self.tail.seek(0)
+    while self.tailLines > maxlines or self.tailBytes > maxbytes:
+      old = self.tail.readline()
+      self.tailLines -= 1
+      self.tailBytes -= len(old)
+      self.elidedLines += 1
+      self.elidedBytes += len(old)
+      if b"LBSERROR" in old:
+        self.elidedErrors = True
+    tailfile = LogSpool(self.build.id).tailfile
+    newtail = open(tailfile + ".new", 'w+b')
+    shutil.copyfileobj(self.tail, newtail)
+    self.tail.close()
+    os.replace(tailfile + ".new", tailfile)
+    self.tail = newtail
+
+  def writetail(self):
+    # the last lines, after a marker for the lines that have been dropped
+    if self.tail is not None:
+      self.compacttail(*self.getlimits())
+      marker = "LBS: " + str(self.elidedLines) + " lines (" + str(self.elidedBytes) + " bytes) of output have been elided"
+      if self.elidedErrors:
+        # so that the build still counts as failed, see getBuildResult
+        marker += ", including lines with LBSERROR"
+      if self.fulloutput is not None:
+        marker += ", see the full output"
+      LogWriter.get().add(self.build, [marker + "\n"])
+      self.tail.seek(0)
+      lines = []
+      for line in self.tail:
+        lines.append(line.decode('utf-8', errors='replace'))
+        if len(lines) >= settings.LOG_FLUSH_SIZE:
+          # the tail can be large, so it is written in parts
+          LogWriter.get().add(self.build, lines)
+          LogWriter.get().Flush()
+          lines = []
+      LogWriter.get().add(self.build, lines)
+    self.closevolumefiles()
+    # the remaining lines are written without limit
+    self.limitVolume = False
+
+  def closevolumefiles(self):
+    if self.tail is not None:
+      self.tail.close()
+      os.remove(LogSpool(self.build.id).tailfile)
+      self.tail = None
+    if self.fulloutput is not None:
+      self.fulloutput.close()
+
   def getLogPath(self, build):
      return build.user.username + "/" + build.project + "/" + build.package + "/" + build.branchname + "/" + build.distro + "/" + build.release + "/" + build.arch
 
   def store(self, DeleteLogAfterDays, KeepMinimumLogs, logpath):
-    if self.build and self.build.id:
-      # store buffered lines to the database
-      for line in self.linebuffer:
-        log = Log(build = self.build, line = line, created=timezone.now())
-        log.save()
-      self.linebuffer = []
-
     LogPath = self.logspath + "/" + logpath
     if not os.path.exists(LogPath):
       Path(LogPath).mkdir(parents=True, exist_ok=True)
     self.build.number=0
     MaximumAgeInSeconds = timezone.now() - datetime.timedelta(days = DeleteLogAfterDays)
-    logfiles=[]
+    logfiles={}
     for file in os.listdir(LogPath):
-      if file.endswith(".log"):
-        logfiles.append(file)
-        oldnumber=int(file[6:-4])
+      # build-000001.log, or build-000001.log.gz with build-000001.log.idx
+      if file.startswith("build-") and (file.endswith(".log") or file.endswith(".log.gz")):
+        oldnumber=int(file[6:12])
+        logfiles[oldnumber] = file
         if oldnumber >= self.build.number:
           self.build.number = oldnumber + 1
-    logfiles=sorted(logfiles)
-    if len(logfiles) > KeepMinimumLogs:
-      for i in range(1, len(logfiles) - KeepMinimumLogs):
-        file=logfiles[i - 1]
+    numbers=sorted(logfiles)
+    if len(numbers) > KeepMinimumLogs:
+      for i in range(1, len(numbers) - KeepMinimumLogs):
+        file=logfiles[numbers[i - 1]]
         # delete older logs, depending on DeleteLogAfterDays
         if make_aware(datetime.datetime.fromtimestamp(os.path.getmtime(LogPath + "/" + file))) < MaximumAgeInSeconds:
-          os.unlink(LogPath + "/" + file)
+          LogArchive(LogPath + "/build-" + str(numbers[i - 1]).zfill(6)).remove()
+    self.writetail()
     self.print("This build took about " + str(round((timezone.now() - self.starttime).total_seconds() / 60)) + " minutes")
-    LogFilePath = self.getLogFile(self.build)
     try:
-      with open(LogFilePath, 'ab') as f:
-        f.write(self.get().encode('utf8'))
+      # the spool file is compressed into the log archive
+      LogWriter.get().Flush()
+      spool = LogSpool(self.build.id)
+      archive = self.getLogArchive(self.build)
+      if self.fulloutput is not None and self.elidedLines > 0:
+        shutil.move(spool.fullfile, archive.fullfile)
+      if spool.exists():
+        archive.create(spool)
+        spool.remove()
+      LiveLogCache.remove(self.build.id)
+      self.stored = True
     except:
       print ("Unexpected error:", sys.exc_info())
     sys.stdout.flush()
@@ -177,21 +296,19 @@ class Logger:
     return self.build.number
 
   def clean(self):
-    # clear log from database
+    # remove the spool file, if the log has not been stored
     if self.build:
-      logs = Log.objects.filter(build = self.build)
-      logs.delete()
+      self.closevolumefiles()
+      LogWriter.get().Flush()
+      LogSpool(self.build.id).remove()
+      LiveLogCache.remove(self.build.id)
 
-  def getLogFile(self, build):
+  def getLogArchive(self, build):
     LogPath = self.logspath + "/" + self.getLogPath(build)
-    return LogPath + "/build-" + str(build.number).zfill(6) + ".log"
+    return LogArchive(LogPath + "/build-" + str(build.number).zfill(6))
 
   def getLog(self, build):
-    filename=self.getLogFile(build)
-    if os.path.isfile(filename):
-      with open(filename, 'r', encoding="utf-8") as content_file:
-        return content_file.read()
-    return ""
+    return self.getLogArchive(build).read()
 
   def getBuildsOfPackage(self, package):
     result = dict()
@@ -214,11 +331,9 @@ class Logger:
 
 
   def getBuildResult(self):
-    LogFilePath = self.getLogFile(self.build)
-    if not os.path.exists(LogFilePath):
+    archive = self.getLogArchive(self.build)
+    if not archive.exists():
       return "failure"
-    with codecs.open(LogFilePath, encoding='utf-8', mode='r') as f:
-        content = f.read()
-    if content.find('LBSERROR') >= 0:
+    if archive.geterrors():
         return "failure"
     return "success"
@@ -23,6 +23,7 @@ import sys
 import os
 import time
 import socket
+import hashlib
 from pathlib import Path
 
 from django.conf import settings
@@ -78,6 +79,19 @@ class RemoteContainer:
     self.arch = ""
     self.staticIP = ""
     self.packageSrcPath = packageSrcPath
+    # the container has been created, started and prepared for building in advance
+    self.prepared = False
+    # name of the snapshot of the prepared container, see Builder.GetSnapshotName
+    self.snapshotname = None
+    # name of the snapshot with the installed build dependancies of the package, see Builder.GetDependanciesSnapshotName
+    self.depssnapshotname = None
+    # name of the snapshot that the container has been restored from. it only needs to be started
+    self.restoredsnapshot = None
+    # the mounts must be installed before the container is started
+    self.mountBeforeStart = True
+    # number of ssh and rsync calls, and how many of them had to open a new ssh connection
+    self.sshcommands = 0
+    self.sshhandshakes = 0
 
   def calculateLocalContainerIP(self, cid):
     # for Incus, we always configure the bridge with 10.0.6:
@@ -112,8 +126,41 @@ class RemoteContainer:
       if "Ubuntu" in version:
         return "10.0.3." + str(cid)
 
+  def getSSHControlPath(self, target):
+    # target is either host or container.
+    # ssh limits the length of the path of the control socket, therefore we use a short hash
+    key = self.containername + "/" + target
+    return os.path.join(settings.SSH_TMP_PATH, "cm-" + hashlib.sha1(key.encode('utf-8')).hexdigest()[:12])
+
+  def getSSHOptions(self, target, port):
+    # all commands and rsync calls of a build share one ssh connection to the host, and one to the container
+    controlpath = self.getSSHControlPath(target)
+    self.sshcommands += 1
+    if not os.path.exists(controlpath):
+      self.sshhandshakes += 1
+    return "-o StrictHostKeyChecking=no -o ControlMaster=auto -o ControlPath=" + controlpath + \
+      " -o ControlPersist=" + str(settings.SSH_CONTROL_PERSIST) + " -o ServerAliveInterval=30" + \
+      " -p " + port + " -i " + self.SSHContainerPath + "container_rsa"
+
+  def closeconnection(self, target):
+    controlpath = self.getSSHControlPath(target)
+    if os.path.exists(controlpath):
+      self.shell.evaluateshell("ssh -o ControlPath=" + controlpath + " -O exit " + self.hostname)
+
+  def closeconnections(self):
+    self.closeconnection("container")
+    self.closeconnection("host")
+    if self.sshcommands > 0:
+      self.logger.print(" * ssh: " + str(self.sshcommands) + " commands, " + str(self.sshhandshakes) + " new connections")
+
+  def getExecuteOnHostCommand(self, command):
+    return "ssh " + self.getSSHOptions("host", self.port) + " root@" + self.hostname + " \"export LC_ALL=C; (" + command + ") 2>&1; echo \\$?\""
+
+  def getExecuteInContainerCommand(self, command):
+    return "ssh " + self.getSSHOptions("container", self.containerPort) + " root@" + self.containerIP + " \"export LC_ALL=C; (" + command + ") 2>&1; echo \\$?\""
+
   def executeOnHost(self, command):
-    if self.shell.executeshell('ssh -f -o "StrictHostKeyChecking no" -p ' + self.port + ' -i ' + self.SSHContainerPath + "/container_rsa root@" + self.hostname + " \"export LC_ALL=C; (" + command + ") 2>&1; echo \$?\""):
+    if self.shell.executeshell(self.getExecuteOnHostCommand(command)):
       return self.logger.getLastLine() == "0"
     return False
 
@@ -125,6 +172,14 @@ class RemoteContainer:
     # not implemented here
     return False
 
+  def usepreparedmachine(self, distro, release, arch, staticIP):
+    # not implemented here
+    return False
+
+  def createsnapshot(self, name):
+    # not implemented here
+    return False
+
   def executeInContainer(self, command):
     """Execute a command in a container via SSH"""
     # not implemented here
@@ -134,9 +189,15 @@ class RemoteContainer:
     # not implemented here
     return False
 
-  def stop(self):
+  def getStopCommand(self):
     # not implemented here
-    return False
+    return None
+
+  def stop(self):
+    command = self.getStopCommand()
+    if command is None:
+      return False
+    return self.executeOnHost(command)
 
   def rsyncContainerPut(self, src, dest):
     # not implemented here
@@ -19,58 +19,75 @@
 # USA
 #
 
+import os
+import codecs
+import selectors
 from subprocess import Popen, PIPE, STDOUT
 from lib.Logger import Logger
 
 class Shell:
+  # how many bytes we read at once from the output of the command
+  CHUNKSIZE = 64*1024
+
   def __init__(self, logger):
     self.logger = logger
 
+  def readoutput(self, child):
+    # yields the output of the child process in lists of lines.
+    # the last line of the output might not end with a newline.
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    fd = child.stdout.fileno()
+    incompleteLine = ""
+    with selectors.DefaultSelector() as selector:
+      selector.register(fd, selectors.EVENT_READ)
+      while True:
+        if not selector.select(timeout=1):
+          # processes that have been started in the background might still keep the pipe open
+          if child.poll() is not None:
+            break
+          continue
+        chunk = os.read(fd, self.CHUNKSIZE)
+        if not chunk:
+          break
+        (lines, incompleteLine) = self.splitlines(decoder, incompleteLine, chunk)
+        if lines:
+          yield lines
+    incompleteLine += decoder.decode(b"", final=True)
+    if incompleteLine:
+      yield [incompleteLine]
+
+  def splitlines(self, decoder, incompleteLine, chunk):
+    # returns the complete lines, and the beginning of the next line
+    lines = (incompleteLine + decoder.decode(chunk)).split("\n")
+    incompleteLine = lines.pop()
+    return ([line + "\n" for line in lines], incompleteLine)
+
   def executeshell(self, command):
     self.logger.print("now running: " + command)
 
-    # see http://stackoverflow.com/questions/14858059/detecting-the-end-of-the-stream-on-popen-stdout-readline
-    # problem is that subprocesses are started, and the pipe is still open???
-    child = Popen(command, stdout=PIPE, stderr=STDOUT, encoding="utf-8", universal_newlines=True, shell=True)
-    processFinished = False
-    returncode=None
-    while True:
-      try:
-        line=child.stdout.readline()
-      except UnicodeDecodeError as e:
-        line="UnicodeDecodeError Problem with decoding the log line"
-      if "LBSERROR" in line:
-        self.logger.print(line, 0)
-      if (len(line) == 0) and processFinished:
-        break;
-      self.logger.print(line, 5)
-      returncode = child.poll()
-      if not processFinished and returncode is not None:
-        processFinished = True
-    child.stdout.close()
+    child = Popen(command, stdout=PIPE, stderr=STDOUT, shell=True)
+    try:
+      for lines in self.readoutput(child):
+        self.logger.printlines(lines, 5)
+    finally:
+      child.stdout.close()
+    returncode = child.wait()
     return (not returncode)
 
   def evaluateshell(self, command):
     #self.logger.print("now running: " + command)
-    result = ""
+    result = []
 
-    # see http://stackoverflow.com/questions/14858059/detecting-the-end-of-the-stream-on-popen-stdout-readline
-    # problem is that subprocesses are started, and the pipe is still open???
-    child = Popen(command, stdout=PIPE, stderr=STDOUT, encoding="utf-8", universal_newlines=True, shell=True)
-    processFinished = False
-    returncode=None
-    #for line in iter(child.stdout.readline,''):
-    while True:
-      line=child.stdout.readline()
-      if "LBSERROR" in line:
-        self.logger.print(line, 0)
-      if (len(line) == 0) and processFinished:
-        break;
-      result += line
-      returncode = child.poll()
-      if not processFinished and returncode is not None:
-        processFinished = True
-    child.stdout.close()
+    child = Popen(command, stdout=PIPE, stderr=STDOUT, shell=True)
+    try:
+      for lines in self.readoutput(child):
+        for line in lines:
+          if "LBSERROR" in line:
+            self.logger.print(line, 0)
+        result.extend(lines)
+    finally:
+      child.stdout.close()
+    returncode = child.wait()
     if (not returncode):
-      return result
+      return "".join(result)
     return returncode
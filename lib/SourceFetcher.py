@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""SourceFetcher: download the archive of a git repository, and unpack it while downloading"""
+
+# Copyright (c) 2014-2024 Timotheus Pokorra
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+# USA
+#
+
+import os
+import shutil
+import tarfile
+import tempfile
+import requests
+
+class SourceFetcher:
+  'one conditional request for the archive. the archive is not stored, but unpacked into a staging directory'
+
+  def __init__(self, url, headers):
+    self.url = url
+    self.headers = headers
+    # the Etag of the downloaded archive
+    self.etag = None
+    self.response = None
+
+  def request(self, etag = None):
+    # returns False if the archive has not changed since etag.
+    # otherwise the body has not been read yet, see extract and close
+    headers = dict(self.headers)
+    if etag:
+      # older etag files contain the Etag without quotes
+      if not etag.startswith('"') and not etag.startswith('W/'):
+        etag = '"' + etag + '"'
+      headers['If-None-Match'] = etag
+    r = requests.get(self.url, headers=headers, stream=True)
+    if r.status_code == 304:
+      r.close()
+      return False
+    if r.status_code == 401:
+      r.close()
+      raise Exception("problem downloading the repository, access denied")
+    elif not r.status_code == 200:
+      r.close()
+      raise Exception("problem downloading the repository " + self.url + ", HTTP error code " + str(r.status_code))
+    if etag and r.headers.get('Etag') == etag:
+      # the server ignores If-None-Match. we do not read the body
+      r.close()
+      return False
+    self.etag = r.headers.get('Etag')
+    self.response = r
+    return True
+
+  def close(self):
+    if self.response is not None:
+      self.response.close()
+      self.response = None
+
+  def extract(self, destination, name):
+    # same as iter_content, in case the server uses a content encoding
+    self.response.raw.decode_content = True
+    SourceFetcher.extracttar(self.response.raw, destination, name, self.url)
+
+  @staticmethod
+  def extracttar(fileobj, destination, name, source):
+    # unpack the stream into a staging directory, and then move it to destination.
+    # destination is a new directory that contains the tree as name, see SourceSnapshots.Create
+    destination = destination.rstrip('/')
+    staging = tempfile.mkdtemp(dir=os.path.dirname(destination), prefix="." + os.path.basename(destination) + "-staging-")
+    try:
+      with tarfile.open(fileobj=fileobj, mode='r|*') as tar:
+        tar.extractall(staging, filter='data')
+      # the archive contains one directory, eg. project-branch
+      entries = os.listdir(staging)
+      if len(entries) != 1 or not os.path.isdir(staging + "/" + entries[0]):
+        raise Exception("Problem with the archive of the git repo " + source)
+      if entries[0] != name:
+        os.rename(staging + "/" + entries[0], staging + "/" + name)
+      os.rename(staging, destination)
+    finally:
+      shutil.rmtree(staging, ignore_errors=True)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""SourceHasher: the hash of the sources of each package, calculated in the process"""
+
+# Copyright (c) 2014-2024 Timotheus Pokorra
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+# USA
+#
+
+import os
+import stat
+import hashlib
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+class SourceHasher:
+  '''the same hash as find <path> -type f -print0 | sort -z | xargs -0 sha1sum | sha1sum, in C locale.
+  the directories are hashed in parallel. the hashes of a snapshot are kept with the snapshot, see SourceSnapshots.GetHashes'''
+
+  instance = None
+  instanceLock = Lock()
+
+  @staticmethod
+  def get():
+    with SourceHasher.instanceLock:
+      if SourceHasher.instance is None:
+        SourceHasher.instance = SourceHasher(settings.SOURCE_HASH_THREADS)
+      return SourceHasher.instance
+
+  def __init__(self, threads):
+    self.threads = threads
+
+  def hashdirectories(self, directories):
+    # directories is a list of (path, name), the name is the path that sha1sum would print.
+    # returns the hashes in the same order
+    with ThreadPoolExecutor(max_workers = self.threads) as executor:
+      return list(executor.map(lambda directory: self.hashdirectory(*directory), directories))
+
+  def hashdirectory(self, path, name):
+    files = []
+    for root, dirs, filenames in os.walk(path):
+      # like find, do not follow symbolic links, and only hash regular files
+      for filename in filenames:
+        filepath = os.path.join(root, filename)
+        st = os.lstat(filepath)
+        if stat.S_ISREG(st.st_mode):
+          files.append((os.fsencode(name + filepath[len(path):]), filepath))
+    if not files:
+      # xargs calls sha1sum without arguments, which reads the empty input
+      return hashlib.sha1(b"da39a3ee5e6b4b0d3255bfef95601890afd80709  -\n").hexdigest()
+    # sort -z compares the bytes
+    files.sort(key = lambda file: file[0])
+    result = hashlib.sha1()
+    for (filename, filepath) in files:
+      digest = self.hashfile(filepath).encode('ascii')
+      if b"\\" in filename or b"\n" in filename:
+        # sha1sum escapes these file names
+        result.update(b"\\" + digest + b"  " + filename.replace(b"\\", b"\\\\").replace(b"\n", b"\\n") + b"\n")
+      else:
+        result.update(digest + b"  " + filename + b"\n")
+    return result.hexdigest()
+
+  def hashfile(self, filepath):
+    sha1 = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+      for chunk in iter(lambda: f.read(1024*1024), b""):
+        sha1.update(chunk)
+    return sha1.hexdigest()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""SourceSnapshots: immutable source trees, shared by all builds that use the same version of a git repository"""
+
+# Copyright (c) 2014-2024 Timotheus Pokorra
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+# USA
+#
+
+import os
+import json
+import time
+import shutil
+import tempfile
+import hashlib
+from pathlib import Path
+
+from django.conf import settings
+
+from builder.models import Build
+
+class SourceSnapshots:
+  '''SOURCE_SNAPSHOTS_PATH/<id>/<git_project_name> is the tree of one version of the repository.
+  the id is derived from the url and the version, eg. the Etag of the archive or the commit of the git mirror, so a tree is never changed after it has been created.
+  the snapshots of running builds are pinned, the other snapshots are deleted in least recently used order,
+  when all snapshots need more than SOURCE_SNAPSHOTS_DISK_BUDGET bytes'''
+
+  @staticmethod
+  def GetId(url, version):
+    return hashlib.sha1((url + "\n" + version).encode('utf-8')).hexdigest()
+
+  @staticmethod
+  def GetPath(snapshotid):
+    return settings.SOURCE_SNAPSHOTS_PATH + "/" + snapshotid
+
+  @staticmethod
+  def Exists(snapshotid):
+    return os.path.isdir(SourceSnapshots.GetPath(snapshotid))
+
+  @staticmethod
+  def GetRefFile(url):
+    # the latest snapshot of the url
+    return settings.SOURCE_SNAPSHOTS_PATH + "/refs/" + hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+  @staticmethod
+  def GetRefUrl(project, branchname):
+    # the archive of the branch, or the branch in the git mirror
+    if project.git_mirror:
+      return project.git_url + "#" + branchname
+    if project.git_type == 'gitlab':
+      return project.git_url + "/repository/archive.tar.gz?ref=" + branchname
+    # gitea and github
+    return project.git_url + "/archive/" + branchname + ".tar.gz"
+
+  @staticmethod
+  def GetRef(url):
+    # returns a dict with version, snapshot and checked, or None
+    try:
+      with open(SourceSnapshots.GetRefFile(url), 'r') as f:
+        ref = json.load(f)
+    except (OSError, ValueError):
+      return None
+    if 'version' not in ref or not SourceSnapshots.Exists(ref['snapshot']):
+      return None
+    return ref
+
+  @staticmethod
+  def GetLatest(project, branchname):
+    # the snapshot that has been fetched last for the branch, or None
+    ref = SourceSnapshots.GetRef(SourceSnapshots.GetRefUrl(project, branchname))
+    if ref is None:
+      return None
+    return ref['snapshot']
+
+  @staticmethod
+  def SetRef(url, version, snapshotid):
+    SourceSnapshots.WriteFile(SourceSnapshots.GetRefFile(url), {'version': version, 'snapshot': snapshotid, 'checked': time.time()})
+
+  @staticmethod
+  def WriteFile(filename, data):
+    # several builds of the same project can write the file at the same time, each in its own temporary file
+    Path(os.path.dirname(filename)).mkdir(parents=True, exist_ok=True)
+    (fd, tmpfile) = tempfile.mkstemp(dir=os.path.dirname(filename), prefix=".tmp-")
+    try:
+      with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+      os.replace(tmpfile, filename)
+    except:
+      if os.path.exists(tmpfile):
+        os.remove(tmpfile)
+      raise
+
+  @staticmethod
+  def GetConfigRef(url, branchname):
+    # returns a dict with the revision of the branch, config and checked, or None.
+    # config tells if the branch at this revision has a config.yml
+    try:
+      with open(SourceSnapshots.GetRefFile(url + "#" + branchname + "#config"), 'r') as f:
+        return json.load(f)
+    except (OSError, ValueError):
+      return None
+
+  @staticmethod
+  def SetConfigRef(url, branchname, revision, config):
+    SourceSnapshots.WriteFile(SourceSnapshots.GetRefFile(url + "#" + branchname + "#config"),
+        {'revision': revision, 'config': config, 'checked': time.time()})
+
+  @staticmethod
+  def GetHashes(snapshotid):
+    # the hashes of the package directories, by the name that has been hashed, see LightBuildServer.StorePackageHashes.
+    # the snapshot does not change, so the hashes only need to be calculated once
+    try:
+      with open(SourceSnapshots.GetPath(snapshotid) + ".hashes", 'r') as f:
+        return json.load(f)
+    except (OSError, ValueError):
+      return {}
+
+  @staticmethod
+  def SetHashes(snapshotid, hashes):
+    SourceSnapshots.WriteFile(SourceSnapshots.GetPath(snapshotid) + ".hashes", hashes)
+
+  @staticmethod
+  def Touch(snapshotid):
+    # for the least recently used order
+    Path(SourceSnapshots.GetPath(snapshotid) + ".used").touch()
+
+  @staticmethod
+  def Create(snapshotid, fetcher, name):
+    # the fetcher has received the response, or the git mirror has resolved the commit.
+    # the tree is stored as name in the snapshot
+    Path(settings.SOURCE_SNAPSHOTS_PATH).mkdir(parents=True, exist_ok=True)
+    path = SourceSnapshots.GetPath(snapshotid)
+    if not os.path.isdir(path):
+      try:
+        fetcher.extract(path, name)
+      except OSError:
+        # another build has created the same snapshot at the same time
+        if not os.path.isdir(path):
+          raise
+      size = 0
+      for root, dirs, files in os.walk(path):
+        for file in files:
+          size += os.lstat(os.path.join(root, file)).st_size
+      with open(path + ".size", 'w') as f:
+        f.write(str(size))
+    SourceSnapshots.Touch(snapshotid)
+    SourceSnapshots.Evict(snapshotid)
+
+  @staticmethod
+  def Evict(keep = None):
+    # the pinned snapshots are used by running builds.
+    # recently used snapshots are kept, eg. for builds that are just starting
+    pinned = set(Build.objects.filter(status='BUILDING').exclude(sourcesnapshot=None).values_list('sourcesnapshot', flat=True))
+    pinned.add(keep)
+    snapshots = []
+    total = 0
+    for entry in os.listdir(settings.SOURCE_SNAPSHOTS_PATH):
+      path = settings.SOURCE_SNAPSHOTS_PATH + "/" + entry
+      if entry.startswith(".") or entry == "refs" or not os.path.isdir(path):
+        continue
+      try:
+        with open(path + ".size", 'r') as f:
+          size = int(f.read())
+        used = os.path.getmtime(path + ".used")
+      except (OSError, ValueError):
+        # the snapshot is being created
+        continue
+      total += size
+      snapshots.append((used, entry, size))
+    minimumage = time.time() - settings.SOURCE_SNAPSHOTS_KEEP_MINUTES * 60
+    for (used, entry, size) in sorted(snapshots):
+      if total <= settings.SOURCE_SNAPSHOTS_DISK_BUDGET:
+        break
+      if entry in pinned or used > minimumage:
+        continue
+      path = settings.SOURCE_SNAPSHOTS_PATH + "/" + entry
+      print("SourceSnapshots: deleting snapshot " + entry)
+      try:
+        # first the size, so that a half deleted snapshot is not counted again
+        os.remove(path + ".size")
+      except OSError:
+        # another process is deleting this snapshot
+        continue
+      shutil.rmtree(path, ignore_errors=True)
+      for filename in (path + ".used", path + ".hashes"):
+        if os.path.exists(filename):
+          os.remove(filename)
+      total -= size
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""WarmPool: keep containers prepared in advance on idle machines"""
+
+# Copyright (c) 2014-2024 Timotheus Pokorra
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+# USA
+#
+
+import traceback
+from threading import Thread
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Q
+
+from lib.IncusContainer import IncusContainer
+from lib.BuildHelperFactory import BuildHelperFactory
+from lib.BuildScheduler import BuildScheduler
+from lib.BuildSupervisor import BuildSupervisor
+from lib.Logger import Logger
+from lib.Builder import Builder
+
+from machines.models import Machine
+from builder.models import Build
+
+class WarmPool:
+  'create, start and prepare containers for the most used build targets, while the machines are idle'
+
+  def __init__(self, LBS):
+    self.LBS = LBS
+
+  def Refill(self):
+    # settings.WARM_POOL: number of prepared containers per build target, eg. {"fedora/42/amd64": 2}
+    if not settings.WARM_POOL:
+      return
+
+    # the waiting builds need the free machines more urgently
+    if Build.objects.filter(status='WAITING').exists():
+      return
+
+    for buildtarget, count in settings.WARM_POOL.items():
+      ready = Machine.objects.filter(prepared_for=buildtarget). \
+          filter(Q(Q(status='AVAILABLE') | Q(status='PREPARING'))).count()
+      while ready < count:
+        buildmachine = self.ClaimIdleMachine(buildtarget)
+        if buildmachine is None:
+          # no idle machine left
+          return
+        thread = Thread(target = self.Prepare, args = (buildmachine, buildtarget))
+        thread.start()
+        ready += 1
+
+  def ClaimIdleMachine(self, buildtarget):
+    # only Incus machines can be prepared in advance:
+    # Docker needs the mounts and the Dockerfile of the package when the container is started
+    m = Machine.objects.filter(status='AVAILABLE').filter(enabled=True). \
+        filter(static=False).filter(type='incus').filter(prepared_for__isnull=True). \
+        order_by('priority', 'id')
+    # if this process dies, the machine is released by LightBuildServer.ReconcileOrphanedBuilds
+    worker = BuildSupervisor.get().name
+    for host in m.values_list('host', flat=True):
+      claimed = Machine.objects.filter(host=host).filter(status='AVAILABLE').filter(prepared_for__isnull=True). \
+          update(status='PREPARING', prepared_for=buildtarget, build=None, worker=worker)
+      if claimed == 1:
+        return host
+    return None
+
+  def Prepare(self, buildmachine, buildtarget):
+    try:
+      self.preparemachine(buildmachine, buildtarget)
+    finally:
+      # this thread has its own database connection
+      close_old_connections()
+
+  def preparemachine(self, buildmachine, buildtarget):
+    print("WarmPool: preparing a container for " + buildtarget + " on " + buildmachine)
+    (distro, release, arch) = buildtarget.split("/")
+    success = False
+    try:
+      machine = Machine.objects.filter(host=buildmachine).first()
+      logger = Logger()
+      container = IncusContainer(buildmachine, machine, logger, None)
+      if settings.PREPARED_SNAPSHOTS:
+        container.snapshotname = Builder(self.LBS, logger).GetSnapshotName(distro, release, arch)
+      if container.createmachine(distro, release, arch, buildmachine):
+        if container.restoredsnapshot:
+          success = container.startmachine()
+        else:
+          buildHelper = BuildHelperFactory.GetBuildHelper(distro, container, None)
+          success = buildHelper.PrepareMachineBeforeStart() and \
+            container.startmachine() and \
+            buildHelper.PrepareMachineAfterStart() and \
+            buildHelper.PrepareForBuilding()
+          if success and container.snapshotname is not None:
+            container.createsnapshot(container.snapshotname)
+      container.closeconnections()
+    except Exception as e:
+      print("WarmPool: problem preparing the container on " + buildmachine + ": " + str(e))
+      traceback.print_exc()
+
+    if success:
+      Machine.objects.filter(host=buildmachine).filter(status='PREPARING'). \
+          update(status='AVAILABLE', worker=None)
+      # a waiting build might be able to use this machine now
+      BuildScheduler.notify()
+    else:
+      # we will try again after the next poll interval of the scheduler
+      Machine.objects.filter(host=buildmachine).filter(status='PREPARING'). \
+          update(status='AVAILABLE', prepared_for=None, worker=None)
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('machines', '0007_alter_machine_type'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='machine',
+            name='prepared_for',
+            field=models.CharField(blank=True, default=None, max_length=250, null=True),
+        ),
+        migrations.AlterField(
+            model_name='machine',
+            name='status',
+            field=models.CharField(choices=[('AVAILABLE', 'AVAILABLE'), ('BUILDING', 'BUILDING'), ('STOPPING', 'STOPPING'), ('PREPARING', 'PREPARING')], default='AVAILABLE', max_length=20),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('machines', '0008_machine_prepared_for'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='machine',
+            name='worker',
+            field=models.CharField(blank=True, default=None, max_length=250, null=True),
+        ),
+    ]
@@ -26,8 +26,14 @@ class Machine(models.Model):
         ("AVAILABLE", "AVAILABLE"),
         ("BUILDING", "BUILDING"),
         ("STOPPING", "STOPPING"),
+        ("PREPARING", "PREPARING"),
     ])
 
+    # distro/release/arch of the container that has been prepared in advance, see WarmPool
+    prepared_for = models.CharField(max_length=250, default=None, null=True, blank=True)
+    # the name of the worker process that is preparing the container, see Worker
+    worker = models.CharField(max_length=250, default=None, null=True, blank=True)
+
     # link to the current build running on this machine
     build = models.ForeignKey(Build, on_delete=models.PROTECT, default=None, null=True, blank=True)
 
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0013_alter_project_git_type'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PackageDependancyClosure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dependantpackage', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='closure_dependantpackage', to='projects.package')),
+                ('requiredpackage', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='closure_requiredpackage', to='projects.package')),
+            ],
+            options={
+                'db_table': 'lbs_package_dependancy_closure',
+                'constraints': [models.UniqueConstraint(fields=('dependantpackage', 'requiredpackage'), name='unique_package_dependancy_closure')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0014_packagedependancyclosure'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='git_mirror',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,43 @@
+from django.db import migrations
+
+
+def backfill_closure(apps, schema_editor):
+    # same as BuildHelper.StorePackageDependancyClosure, for the existing dependancies of all projects
+    PackageDependancy = apps.get_model('projects', 'PackageDependancy')
+    PackageDependancyClosure = apps.get_model('projects', 'PackageDependancyClosure')
+
+    requires = {}
+    projects = {}
+    for dependant, required, project in PackageDependancy.objects. \
+            values_list('dependantpackage_id', 'requiredpackage_id', 'dependantpackage__project_id'):
+        requires.setdefault(dependant, set()).add(required)
+        projects[dependant] = project
+
+    closure = []
+    for dependant in requires:
+        visited = set()
+        todo = list(requires[dependant])
+        while todo:
+            required = todo.pop()
+            if required in visited or required == dependant:
+                continue
+            visited.add(required)
+            # only follow the dependancies within the project of the dependant package
+            if projects.get(required) == projects[dependant]:
+                todo.extend(requires.get(required, ()))
+        for required in visited:
+            closure.append(PackageDependancyClosure(dependantpackage_id=dependant, requiredpackage_id=required))
+
+    PackageDependancyClosure.objects.all().delete()
+    PackageDependancyClosure.objects.bulk_create(closure, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0015_project_git_mirror'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_closure, migrations.RunPython.noop),
+    ]
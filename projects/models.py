@@ -17,6 +17,8 @@ class Project(models.Model):
         ("gitlab", "Gitlab"),
     ])
     git_private_token = models.CharField(max_length=250, default=None, null=True, blank=True)
+    # keep a local mirror and fetch the new commits, instead of downloading the archive of the branch
+    git_mirror = models.BooleanField(default = False)
 
     public_key_id = models.CharField(max_length=250, null=True, blank=True)
     machine = models.ForeignKey(Machine, on_delete=models.PROTECT, null=True, blank=True)
@@ -111,6 +113,19 @@ class PackageDependancy(models.Model):
     class Meta:
         db_table = "lbs_package_dependancy"
 
+class PackageDependancyClosure(models.Model):
+    # all direct and indirect dependancies, calculated from PackageDependancy.
+    # this allows to check with a single query if a package depends on another package.
+    dependantpackage = models.ForeignKey(Package, related_name='closure_dependantpackage', on_delete=models.CASCADE)
+    requiredpackage = models.ForeignKey(Package, related_name='closure_requiredpackage', on_delete=models.CASCADE)
+
+    class Meta:
+        db_table = "lbs_package_dependancy_closure"
+
+        constraints = [
+            models.UniqueConstraint(fields=["dependantpackage", "requiredpackage"], name="unique_package_dependancy_closure")
+        ]
+
 
 class Distro(models.Model):
     package = models.ForeignKey(Package, on_delete=models.CASCADE)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""Benchmark: how many lines per second we can pass from a shell command through Shell and the Logger to the spool file"""
+
+# Copyright (c) 2014-2024 Timotheus Pokorra
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+# USA
+#
+
+import sys, os
+import time
+import argparse
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "lbs.settings")
+import django
+django.setup()
+
+from builder.models import Build
+from lib.Logger import Logger
+from lib.LogSpool import LogSpool
+from lib.LogWriter import LogWriter
+from lib.Shell import Shell
+
+parser = argparse.ArgumentParser(description="measure the throughput of Shell.executeshell")
+parser.add_argument("--lines", type=int, default=500000, help="number of lines that the command prints")
+parser.add_argument("--linelength", type=int, default=80, help="number of characters per line")
+parser.add_argument("--buildid", type=int, default=0, help="a build id that is not in the database, only its spool files are written")
+args = parser.parse_args()
+
+# similar to the output of a compiler
+command = "yes 'gcc -O2 -c " + "x" * max(0, args.linelength - 14) + ".c' | head -n " + str(args.lines)
+
+# like a build, the output goes through the LogWriter and the limit of the log volume into the spool file
+build = Build(id=args.buildid)
+logger = Logger(build)
+shell = Shell(logger)
+# we measure the pump, the logger and the spool file, not the terminal
+stdout = sys.stdout
+sys.stdout = open(os.devnull, 'w')
+try:
+  start = time.perf_counter()
+  result = shell.executeshell(command)
+  # the lines that are still pending are written at the end of the build as well
+  LogWriter.get().Flush()
+  duration = time.perf_counter() - start
+  spoollines = LogSpool(build.id).countlines()
+finally:
+  sys.stdout.close()
+  sys.stdout = stdout
+  logger.clean()
+
+print("result: " + str(result))
+print("lines: %d, seconds: %.2f, lines per second: %d" % (args.lines, duration, args.lines / duration))
+print("lines in the spool file: %d" % spoollines)
+print("log writer statistics: " + str(LogWriter.get().GetStats()))